@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from base64 import b64encode
+from tempfile import TemporaryDirectory
+from multiprocessing import get_context
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import platform
+import importlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import har_extractor
+from har_extractor import get_entries, get_metadata, extract, format_size
+
+
+IJSON_BACKENDS = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+MIME_TYPES = (
+    ('text/html', False),
+    ('application/javascript', False),
+    ('text/css', False),
+    ('application/json', False),
+    ('image/png', True),
+    ('image/jpeg', True),
+    ('font/woff2', True)
+)
+SYS_TIME_WARNING = 0.3
+
+
+def random_bytes(rnd, size):
+    if size <= 0:
+        return b''
+    return rnd.getrandbits(size * 8).to_bytes(size, 'little')
+
+def random_name(rnd):
+    return '%08x' % rnd.getrandbits(32)
+
+def random_path(rnd, depth):
+    return '/'.join(random_name(rnd) for _ in range(rnd.randint(1, depth)))
+
+def body_size(rnd, median, sigma, max_size):
+    if sigma <= 0:
+        return median
+    size = int(rnd.lognormvariate(math.log(max(median, 1)), sigma))
+    return min(size, max_size)
+
+def generate_entry(rnd, url, args):
+    mime, binary = rnd.choice(MIME_TYPES)
+    size = body_size(rnd, args.size, args.size_sigma, args.max_size)
+    body = random_bytes(rnd, size)
+    content = {'mimeType': mime, 'size': size}
+    if binary or rnd.random() < args.base64_ratio:
+        content['text'] = b64encode(body).decode('ascii')
+        content['encoding'] = 'base64'
+    else:
+        content['text'] = b64encode(body).decode('ascii')[:size]
+    return {
+        'startedDateTime': '2020-01-01T00:00:00.000Z',
+        'time': rnd.randint(1, 1000),
+        'request': {
+            'method': 'GET',
+            'url': url,
+            'httpVersion': 'HTTP/1.1',
+            'headers': [
+                {'name': 'Accept', 'value': '*/*'},
+                {'name': 'User-Agent', 'value': 'benchmark'}
+            ],
+            'queryString': [],
+            'cookies': [],
+            'headersSize': -1,
+            'bodySize': 0
+        },
+        'response': {
+            'status': 200,
+            'statusText': 'OK',
+            'httpVersion': 'HTTP/1.1',
+            'headers': [
+                {'name': 'Content-Type', 'value': mime},
+                {'name': 'Content-Length', 'value': str(size)}
+            ],
+            'cookies': [],
+            'content': content,
+            'redirectURL': '',
+            'headersSize': -1,
+            'bodySize': size
+        },
+        'cache': {},
+        'timings': {'send': 0, 'wait': 1, 'receive': 1}
+    }
+
+def generate(fname, args):
+    rnd = random.Random(args.seed)
+    hosts = ['host%d.example.com' % i for i in range(args.hosts)]
+    urls = []
+    with open(fname, 'w') as fp:
+        fp.write('{"log": {"version": "1.2", "creator": '
+                 '{"name": "benchmark", "version": "1.0"}, "entries": [\n')
+        for i in range(args.entries):
+            if urls and rnd.random() < args.duplicate_ratio:
+                url = rnd.choice(urls)
+            else:
+                url = 'https://%s/%s' % (rnd.choice(hosts),
+                                         random_path(rnd, args.depth))
+                urls.append(url)
+            if i:
+                fp.write(',\n')
+            json.dump(generate_entry(rnd, url, args), fp)
+        fp.write('\n]}}\n')
+
+
+def count_entries(entries):
+    ret = 0
+    for _ in entries:
+        ret += 1
+    return ret
+
+def bench_parse(fname, iterative, backend):
+    if backend is not None:
+        har_extractor.ijson = importlib.import_module(
+            'ijson.backends.' + backend
+        )
+    with open(fname, 'rb') as fp:
+        return count_entries(get_entries(fp, iterative))
+
+def bench_metadata(fname):
+    with open(fname, 'rb') as fp:
+        return count_entries(get_metadata(fp))
+
+def load_entries(fname, outdir, subdirs):
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    with open(fname, 'rb') as fp:
+        entries = list(get_entries(fp, False))
+    return entries, outdir, subdirs
+
+def bench_extract(entries, outdir, subdirs):
+    extract(entries, outdir, subdirs, False, True)
+    return len(entries)
+
+def run(setup, func, args, queue):
+    if setup is not None:
+        args = setup(*args)
+    start = time.perf_counter()
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    entries = func(*args)
+    ret = {
+        'entries': entries,
+        'wall': time.perf_counter() - start
+    }
+    if resource is not None:
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        ret['user'] = end.ru_utime - usage.ru_utime
+        ret['sys'] = end.ru_stime - usage.ru_stime
+        ret['maxrss'] = end.ru_maxrss * 1024
+    queue.put(ret)
+
+def measure(setup, func, args, repeat):
+    context = get_context('fork')
+    best = None
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=run,
+                                  args=(setup, func, args, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        if best is None or result['wall'] < best['wall']:
+            best = result
+    return best
+
+def get_benchmarks(fname, tmp):
+    yield 'parse', None, bench_parse, (fname, False, None)
+    for backend in IJSON_BACKENDS:
+        try:
+            importlib.import_module('ijson.backends.' + backend)
+        except ImportError:
+            continue
+        yield 'parse-iterative-%s' % backend, None, bench_parse, \
+            (fname, True, backend)
+    yield 'metadata', None, bench_metadata, (fname,)
+    yield 'extract', load_entries, bench_extract, \
+        (fname, os.path.join(tmp, 'flat'), False)
+    yield 'extract-subdirs', load_entries, bench_extract, \
+        (fname, os.path.join(tmp, 'subdirs'), True)
+
+def format_result(name, result):
+    ret = '%-28s %8.3fs %10s/s %10.0f/s' % (
+        name, result['wall'],
+        format_size(int(result['bytes_per_s'])),
+        result['entries_per_s']
+    )
+    if 'sys' in result:
+        ret += ' %7.3fs %7.3fs %9s' % (
+            result['user'], result['sys'], format_size(result['maxrss'])
+        )
+        if result['sys'] > SYS_TIME_WARNING * result['wall']:
+            ret += ' syscall-heavy'
+    return ret
+
+def compare(results, fname):
+    with open(fname) as fp:
+        old = json.load(fp)
+    old = {result['name']: result for result in old['results']}
+    print()
+    print('compared to %s:' % fname)
+    for result in results:
+        prev = old.get(result['name'])
+        if prev is None:
+            continue
+        print('%-28s %8.3fs -> %8.3fs %6.2fx' % (
+            result['name'], prev['wall'], result['wall'],
+            prev['wall'] / result['wall'] if result['wall'] else 0
+        ))
+
+
+def main(args=None):
+    parser = ArgumentParser(description='har-extractor benchmarks')
+
+    parser.add_argument('-n', '--entries', type=int, default=2000,
+                        help='number of entries (default: 2000)')
+    parser.add_argument('--size', type=int, default=16384,
+                        help='median body size (default: 16384)')
+    parser.add_argument('--size-sigma', type=float, default=1.0,
+                        help='body size log-normal sigma (default: 1.0)')
+    parser.add_argument('--max-size', type=int, default=16 * 1024 * 1024,
+                        help='maximum body size (default: 16M)')
+    parser.add_argument('--base64-ratio', type=float, default=0.5,
+                        help='fraction of text bodies stored as base64'
+                        ' (default: 0.5)')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help='fraction of entries reusing an earlier url'
+                        ' (default: 0.1)')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='maximum url path depth (default: 3)')
+    parser.add_argument('--hosts', type=int, default=4,
+                        help='number of hosts (default: 4)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per benchmark, best is kept (default: 3)')
+    parser.add_argument('-k', '--filter', metavar='SUBSTRING', default=None,
+                        help='run only benchmarks containing SUBSTRING')
+    parser.add_argument('-i', '--input', metavar='FILE', default=None,
+                        help='benchmark an existing HAR file')
+    parser.add_argument('-g', '--generate', metavar='FILE', default=None,
+                        help='only generate a HAR file')
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help='save results as JSON')
+    parser.add_argument('-c', '--compare', metavar='FILE', default=None,
+                        help='compare with saved results')
+
+    args = parser.parse_args(args)
+
+    if args.generate:
+        generate(args.generate, args)
+        return 0
+
+    with TemporaryDirectory() as tmp:
+        fname = args.input
+        if fname is None:
+            fname = os.path.join(tmp, 'benchmark.har')
+            generate(fname, args)
+        size = os.path.getsize(fname)
+        print('%s: %s' % (fname, format_size(size)))
+        print('%-28s %9s %12s %11s %8s %8s %9s' % (
+            'benchmark', 'wall', 'bytes', 'entries', 'user', 'sys', 'rss'
+        ))
+        results = []
+        for name, setup, func, func_args in get_benchmarks(fname, tmp):
+            if args.filter is not None and args.filter not in name:
+                continue
+            result = measure(setup, func, func_args, args.repeat)
+            result['name'] = name
+            result['bytes_per_s'] = size / result['wall']
+            result['entries_per_s'] = result['entries'] / result['wall']
+            results.append(result)
+            print(format_result(name, result))
+
+    if args.output:
+        params = vars(args).copy()
+        for key in ('output', 'compare', 'generate'):
+            del params[key]
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'version': har_extractor.__version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'input_size': size,
+                'params': params,
+                'results': results
+            }, fp, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,11 +4,57 @@ from argparse import ArgumentParser
 from urllib.parse import urlparse
 from base64 import b64decode
 from itertools import count
+from bisect import bisect_right
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, CancelledError,
+    TimeoutError as FutureTimeoutError
+)
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO, BytesIO, BufferedReader, FileIO
+from codecs import getincrementaldecoder
+from tempfile import SpooledTemporaryFile
+from hashlib import sha256
+from threading import Lock, Event, Semaphore
+from time import perf_counter
 
 import os
 import sys
+import glob
+import re
+import fnmatch
 import json
+import csv
 import shutil
+import gzip
+import time
+import tarfile
+import zipfile
+import asyncio
+import mmap
+import stat
+import struct
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 try:
     import ijson.backends.yajl2_cffi as ijson
@@ -21,12 +67,105 @@ except ImportError:
         except ImportError:
             ijson = None
 
+try:
+    import orjson as json_backend
+except ImportError:
+    try:
+        import ujson as json_backend
+    except ImportError:
+        json_backend = None
+
 
 __appname__ = 'har-extractor'
 __version__ = '1.0.1'
 
-NAME_VERSION = '%s %s' % (__appname__, __version__)
+
+def get_backends():
+    ret = 'json: %s' % getattr(json_backend, '__name__', 'json')
+    if ijson is not None:
+        ret += ', ijson: %s' % getattr(ijson, 'backend', 'python')
+    return ret
+
+NAME_VERSION = '%s %s (%s)' % (__appname__, __version__, get_backends())
 SIZE_UNITS = 'BKMGT'
+BASE64_CHUNK_SIZE = 1024 * 1024
+BASE64_INVALID = re.compile('[^A-Za-z0-9+/=]+')
+STORE_DIR = '.objects'
+CACHE_SIZE = 1024 ** 3
+CACHE_BLOCK_SIZE = 1024 * 1024
+SPOOL_SIZE = 16 * 1024 * 1024
+FICLONE = 0x40049409
+JOURNAL_NAME = '.journal'
+SHARDS_NAME = '.shards'
+SHARD_WIDTH = 2
+MANIFEST_FIELDS = ('index', 'method', 'url', 'status', 'mime', 'size',
+                   'written', 'path', 'sha256', 'error')
+INDEX_EXT = '.idx'
+INDEX_VERSION = 1
+SCAN_BLOCK_SIZE = 1024 * 1024
+SCAN_STRING = re.compile(b'[^"\\\\]*(?:\\\\.[^"\\\\]*)*', re.DOTALL)
+SCAN_WHITESPACE = re.compile('[ \\t\\n\\r]*')
+SCAN_KEEP = 64
+SCAN_SKIP_KEYS = (b'text',)
+SCAN_SKIPPED = b'"-"'
+SPLIT_CHUNKS = 4
+LIST_BATCH_SIZE = 1024
+STDIN = '-'
+FOLLOW_INTERVAL = 0.25
+ASYNC_CHUNK_SIZE = 64 * 1024
+ASYNC_QUEUE_SIZE = 16
+ASYNC_POLL_INTERVAL = 0.1
+FOLLOW_FORMATS = ('ndjson', 'har')
+STATS_PHASES = ('parse', 'decode', 'name', 'mkdir', 'write')
+ARCHIVE_FORMATS = (
+    ('.zip', 'zip'),
+    ('.tar', 'w'),
+    ('.tar.gz', 'w:gz'),
+    ('.tgz', 'w:gz'),
+    ('.tar.bz2', 'w:bz2'),
+    ('.tbz2', 'w:bz2'),
+    ('.tar.xz', 'w:xz'),
+    ('.txz', 'w:xz'),
+    ('.sqlite', 'sqlite'),
+    ('.sqlite3', 'sqlite')
+)
+SQLITE_MAGIC = b'SQLite format 3\x00'
+SQLITE_BATCH_SIZE = 1000
+SQLITE_SCHEMA = '''
+CREATE TABLE bodies (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    method TEXT,
+    url TEXT,
+    host TEXT,
+    status INTEGER,
+    status_text TEXT,
+    mime TEXT,
+    size INTEGER,
+    started TEXT,
+    time REAL,
+    timings TEXT,
+    name TEXT,
+    sha256 TEXT REFERENCES bodies (sha256)
+);
+CREATE INDEX entries_host ON entries (host);
+CREATE INDEX entries_mime ON entries (mime);
+CREATE INDEX entries_status ON entries (status);
+CREATE INDEX entries_size ON entries (size);
+'''
+COMPRESSION_MAGIC = (
+    ('gzip', b'\x1f\x8b'),
+    ('bzip2', b'BZh'),
+    ('xz', b'\xfd7zXZ\x00')
+)
+AUTO = 'auto'
+FULL_LOAD_FACTOR = 3
+FAST_FULL_LOAD_FACTOR = 2
+COMPRESSION_RATIO = 10
 
 
 def format_size(size):
@@ -53,14 +192,491 @@ def get_unused_name(path):
             return path
         i += 1
 
+
+def get_suffixes(path):
+    ret = ()
+    name, ext = os.path.splitext(path)
+    if ext[1:].isdigit():
+        ret += ((name, int(ext[1:])),)
+    base, suffix = os.path.splitext(name)
+    if suffix[1:].isdigit():
+        ret += ((base + ext, int(suffix[1:])),)
+    return ret
+
+
+class NameAllocator(object):
+    def __init__(self, root=None):
+        self.root = None
+        self.used = set()
+        self.dirs = set()
+        self.next = {}
+        self.on_rename = None
+        if root is not None:
+            self.root = os.path.normpath(root)
+            self.scan(root)
+
+    def scan(self, root):
+        for path, dirs, files in os.walk(root):
+            path = os.path.normpath(path)
+            self.dirs.add(path)
+            for name in dirs:
+                self.used.add(os.path.join(path, name))
+            for name in files:
+                self.used.add(os.path.join(path, name))
+
+    def exists(self, path):
+        return os.path.normpath(path) in self.used
+
+    def add(self, path):
+        key = os.path.normpath(path)
+        self.used.add(key)
+        parent = os.path.dirname(key)
+        while parent and parent != self.root and parent not in self.used:
+            self.used.add(parent)
+            parent = os.path.dirname(parent)
+
+    def is_dir(self, path):
+        return os.path.normpath(path) in self.dirs
+
+    def add_dir(self, path):
+        key = os.path.normpath(path)
+        while key and key not in self.dirs:
+            self.dirs.add(key)
+            self.used.add(key)
+            if key == self.root:
+                break
+            key = os.path.dirname(key)
+
+    def release(self, path):
+        key = os.path.normpath(path)
+        self.used.discard(key)
+        if key in self.dirs:
+            prefix = os.path.join(key, '')
+            self.dirs = set(
+                d for d in self.dirs
+                if d != key and not d.startswith(prefix)
+            )
+        for base, i in get_suffixes(key):
+            if self.next.get(base, 1) > i:
+                self.next[base] = i
+
+    def rename(self, src, dst):
+        key = os.path.normpath(src)
+        dst = os.path.normpath(dst)
+        prefix = os.path.join(key, '')
+        used = [path for path in self.used if path.startswith(prefix)]
+        dirs = [path for path in self.dirs
+                if path == key or path.startswith(prefix)]
+        self.used.difference_update(used)
+        self.release(src)
+        self.add(dst)
+        for path in used:
+            self.add(os.path.join(dst, path[len(prefix):]))
+        for path in dirs:
+            self.add_dir(os.path.join(dst, path[len(prefix):]))
+        if self.on_rename is not None:
+            self.on_rename(key, dst)
+
+    def claim(self, path):
+        key = os.path.normpath(path)
+        if key not in self.used:
+            self.add(key)
+            return path
+        name, ext = os.path.splitext(path)
+        i = self.next.get(key, 1)
+        while True:
+            ret = '%s.%d%s' % (name, i, ext)
+            ret_key = os.path.normpath(ret)
+            i += 1
+            if ret_key not in self.used:
+                break
+        self.next[key] = i
+        self.add(ret_key)
+        return ret
+
+
 def write(content, fname):
     if isinstance(content, bytes):
         mode = 'wb'
-    else:
+    elif isinstance(content, str):
         mode = 'w'
+    else:
+        try:
+            with open(fname, 'wb') as fp:
+                for chunk in content:
+                    fp.write(chunk)
+        except ValueError:
+            os.remove(fname)
+            raise
+        return
     with open(fname, mode) as fp:
         fp.write(content)
 
+def copy_file(src, dst):
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    if fcntl is not None:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+
+
+class ContentStore(object):
+    def __init__(self, root):
+        self.root = root
+        self.lock = Lock()
+        self.tmp = count()
+        self.objects = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.inodes_saved = 0
+
+    def get_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get_tmp_path(self):
+        return os.path.join(self.root, 'tmp.%d.%d' % (os.getpid(),
+                                                      next(self.tmp)))
+
+    def put(self, content):
+        os.makedirs(self.root, exist_ok=True)
+        if isinstance(content, (bytes, str)):
+            if isinstance(content, str):
+                digest = sha256(content.encode('utf-8')).hexdigest()
+            else:
+                digest = sha256(content).hexdigest()
+            path = self.get_path(digest)
+            if os.path.exists(path):
+                return path, False
+            tmp = self.get_tmp_path()
+            write(content, tmp)
+        else:
+            hash_ = sha256()
+            tmp = self.get_tmp_path()
+            try:
+                with open(tmp, 'wb') as fp:
+                    for chunk in content:
+                        hash_.update(chunk)
+                        fp.write(chunk)
+            except ValueError:
+                os.remove(tmp)
+                raise
+            path = self.get_path(hash_.hexdigest())
+
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(tmp)
+                return path, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+            self.objects += 1
+        return path, True
+
+    def save(self, content, fname):
+        path, new = self.put(content)
+        tmp = os.path.join(os.path.dirname(fname), '.tmp.%d.%d' % (
+            os.getpid(), next(self.tmp)
+        ))
+        try:
+            os.link(path, tmp)
+            hardlink = True
+        except OSError:
+            os.symlink(os.path.abspath(path), tmp)
+            hardlink = False
+        try:
+            os.replace(tmp, fname)
+        finally:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+        if not new:
+            size = os.path.getsize(path)
+            with self.lock:
+                self.duplicates += 1
+                self.bytes_saved += size
+                if hardlink:
+                    self.inodes_saved += 1
+
+    def format_stats(self):
+        return '%d objects, %d duplicates, %s saved, %d inodes saved' % (
+            self.objects, self.duplicates,
+            format_size(self.bytes_saved), self.inodes_saved
+        )
+
+
+class BodyCache(object):
+    def __init__(self, root, max_size=CACHE_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.lock = Lock()
+        self.tmp = count()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+
+    def get_key(self, text, encoding):
+        hash_ = sha256(('%s:' % encoding).encode('utf-8'))
+        if isinstance(text, FileText):
+            for chunk in text.chunks():
+                hash_.update(chunk.encode('utf-8'))
+        elif isinstance(text, str):
+            hash_.update(text.encode('utf-8'))
+        else:
+            hash_.update(text)
+        return hash_.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key, fname, hash_=None):
+        path = self.get_path(key)
+        try:
+            copy_file(path, fname)
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+        size = os.path.getsize(fname)
+        if hash_ is not None:
+            with open(fname, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(CACHE_BLOCK_SIZE), b''):
+                    hash_.update(chunk)
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += size
+        return True
+
+    def put(self, key, fname):
+        path = self.get_path(key)
+        tmp = os.path.join(self.root, 'tmp.%d.%d' % (os.getpid(),
+                                                     next(self.tmp)))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy_file(fname, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def add_stats(self, stats):
+        self.hits += stats[0]
+        self.misses += stats[1]
+        self.bytes_saved += stats[2]
+
+    def get_stats(self):
+        return self.hits, self.misses, self.bytes_saved
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        objects = []
+        total = 0
+        for path, _, files in os.walk(self.root):
+            for name in files:
+                fname = os.path.join(path, name)
+                try:
+                    info = os.stat(fname)
+                except OSError:
+                    continue
+                objects.append((info.st_mtime, info.st_size, fname))
+                total += info.st_size
+        objects.sort()
+        for _, size, fname in objects:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def format_stats(self):
+        return 'cache: %d hits, %d misses, %s reused, %d evicted' % (
+            self.hits, self.misses, format_size(self.bytes_saved),
+            self.evicted
+        )
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+        self.started = {}
+        self.done = {}
+
+    def load(self):
+        try:
+            fp = open(self.path, 'rb')
+        except (OSError, IOError):
+            return
+        size = 0
+        with fp:
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                    index = record.get('index')
+                    path = record['path']
+                except (ValueError, KeyError, TypeError):
+                    break
+                if 'move' in record:
+                    self.rename(record['move'], path)
+                elif 'sha256' in record:
+                    self.started.pop(index, None)
+                    self.done[index] = (path, record['sha256'])
+                else:
+                    self.started[index] = path
+                size += len(line)
+        if size != os.path.getsize(self.path):
+            os.truncate(self.path, size)
+
+    def paths(self):
+        return ([path for path, _ in self.done.values()]
+                + list(self.started.values()))
+
+    def clean(self):
+        done = set(path for path, _ in self.done.values())
+        for path in self.started.values():
+            if path in done:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.started = {}
+
+    def open(self):
+        self.fp = open(self.path, 'a')
+
+    def add(self, record):
+        self.fp.write(json.dumps(record, separators=(',', ':')))
+        self.fp.write('\n')
+        self.fp.flush()
+
+    def start(self, index, path):
+        self.add({'index': index, 'path': path})
+
+    def finish(self, index, path, digest):
+        self.add({'index': index, 'path': path, 'sha256': digest})
+        self.done[index] = (path, digest)
+
+    def move(self, src, dst):
+        self.add({'move': src, 'path': dst})
+        self.rename(src, dst)
+
+    def rename(self, src, dst):
+        prefix = os.path.join(src, '')
+
+        def get_path(path):
+            key = os.path.normpath(path)
+            if key == src:
+                return dst
+            if key.startswith(prefix):
+                return os.path.join(dst, key[len(prefix):])
+            return path
+
+        self.started = {index: get_path(path)
+                        for index, path in self.started.items()}
+        self.done = {index: (get_path(path), digest)
+                     for index, (path, digest) in self.done.items()}
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class Manifest(object):
+    def __init__(self, fp, fmt='jsonl', header=True):
+        self.fp = fp
+        self.writer = None
+        if fmt == 'csv':
+            self.writer = csv.writer(fp)
+            if header:
+                self.writer.writerow(MANIFEST_FIELDS)
+
+    def add(self, result):
+        entry = result.entry
+        if not isinstance(entry, dict):
+            entry = {}
+        request = entry.get('request', {})
+        response = entry.get('response', {})
+        content = response.get('content', {})
+        written = result.status in ('written', 'done')
+        record = {
+            'index': result.index,
+            'method': request.get('method'),
+            'url': request.get('url'),
+            'status': response.get('status'),
+            'mime': content.get('mimeType'),
+            'size': content.get('size'),
+            'written': result.size,
+            'path': result.path if written else None,
+            'sha256': result.sha256,
+            'error': None if result.error is None else str(result.error)
+        }
+        if self.writer is not None:
+            self.writer.writerow([record[key] for key in MANIFEST_FIELDS])
+        else:
+            self.fp.write(json.dumps(record))
+            self.fp.write('\n')
+
+def get_manifest_format(path):
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+def get_shard_path(entry, depth, width=SHARD_WIDTH):
+    name = get_entry_path(entry)
+    digest = sha256(entry['request']['url'].encode('utf-8')).hexdigest()
+    parts = [digest[i * width:(i + 1) * width] for i in range(depth)]
+    return os.path.join(*parts, name)
+
+
+class ShardIndex(object):
+    def __init__(self, root, depth, width=SHARD_WIDTH):
+        self.root = root
+        self.depth = depth
+        self.width = width
+        self.path = os.path.join(root, SHARDS_NAME)
+        self.fp = None
+
+    def get_path(self, entry):
+        return get_shard_path(entry, self.depth, self.width)
+
+    def open(self, append=False):
+        os.makedirs(self.root, exist_ok=True)
+        self.fp = open(self.path, 'a' if append else 'w')
+
+    def add(self, result):
+        if result.status != 'written':
+            return
+        self.fp.write(json.dumps({
+            'name': get_entry_path(result.entry),
+            'url': result.entry['request']['url'],
+            'path': os.path.relpath(result.path, self.root)
+        }))
+        self.fp.write('\n')
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
 def format_entry(entry):
     request = entry.get('request', {})
     response = entry.get('response', {})
@@ -74,67 +690,1340 @@ def format_entry(entry):
         format_size(content.get('size', -1))
     )
 
-def get_entry_content(entry):
+class Stats(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.phases = {name: [0.0, 0, 0, 0] for name in STATS_PHASES}
+        self.entries = 0
+        self.start = perf_counter()
+        self.wall = None
+
+    def add(self, phase, elapsed, bytes_in=0, bytes_out=0):
+        with self.lock:
+            item = self.phases[phase]
+            item[0] += elapsed
+            item[1] += 1
+            item[2] += bytes_in
+            item[3] += bytes_out
+
+    def add_time(self, phase, elapsed):
+        with self.lock:
+            self.phases[phase][0] += elapsed
+
+    def set_input_size(self, size):
+        with self.lock:
+            self.phases['parse'][2] = size
+
+    def iterate(self, entries):
+        entries = iter(entries)
+        while True:
+            start = perf_counter()
+            try:
+                entry = next(entries)
+            except StopIteration:
+                self.add_time('parse', perf_counter() - start)
+                return
+            self.add('parse', perf_counter() - start)
+            self.entries += 1
+            yield entry
+
+    def stop(self):
+        self.wall = perf_counter() - self.start
+
+    def to_dict(self):
+        wall = self.wall
+        if wall is None:
+            wall = perf_counter() - self.start
+        ret = {
+            'wall': wall,
+            'entries': self.entries,
+            'entries_per_s': self.entries / wall if wall else 0,
+            'phases': {}
+        }
+        for name in STATS_PHASES:
+            elapsed, calls, bytes_in, bytes_out = self.phases[name]
+            ret['phases'][name] = {
+                'time': elapsed,
+                'calls': calls,
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out,
+                'calls_per_s': calls / elapsed if elapsed else 0
+            }
+        return ret
+
+    def format(self):
+        data = self.to_dict()
+        lines = ['%-8s %10s %10s %10s %10s %12s' % (
+            'phase', 'time', 'calls', 'in', 'out', 'calls/s'
+        )]
+        for name in STATS_PHASES:
+            phase = data['phases'][name]
+            lines.append('%-8s %9.3fs %10d %10s %10s %12.0f' % (
+                name, phase['time'], phase['calls'],
+                format_size(phase['bytes_in']),
+                format_size(phase['bytes_out']),
+                phase['calls_per_s']
+            ))
+        lines.append('%d entries in %.3fs, %.0f entries/s' % (
+            data['entries'], data['wall'], data['entries_per_s']
+        ))
+        return '\n'.join(lines)
+
+
+class StatsStream(object):
+    def __init__(self, stream, stats):
+        self.stream = stream
+        self.stats = stats
+        self.elapsed = 0.0
+        self.size = 0
+
+    def __iter__(self):
+        chunks = iter(self.stream)
+        while True:
+            start = perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                self.elapsed += perf_counter() - start
+                break
+            self.elapsed += perf_counter() - start
+            self.size += len(chunk)
+            yield chunk
+        self.stats.add('decode', self.elapsed,
+                       len(self.stream.text), self.size)
+
+
+class ContentHash(object):
+    def __init__(self):
+        self.hash = sha256()
+        self.size = 0
+
+    def update(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class HashStream(object):
+    def __init__(self, stream, hash_):
+        self.stream = stream
+        self.hash = hash_
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.hash.update(chunk)
+            yield chunk
+
+
+class Sink(object):
+    threaded = False
+
+    def __init__(self, root=''):
+        self.root = root
+
+    def get_names(self):
+        return NameAllocator()
+
+    def prepare(self, fname, names):
+        pass
+
+    def write(self, content, fname):
+        raise NotImplementedError()
+
+    def record(self, result):
+        pass
+
+    def close(self):
+        pass
+
+    def format_stats(self):
+        return None
+
+
+class FileSink(Sink):
+    threaded = True
+
+    def __init__(self, root, dedupe=False, scan=True):
+        super().__init__(root)
+        os.makedirs(root, exist_ok=True)
+        self.scan = scan
+        self.store = None
+        if dedupe:
+            self.store = ContentStore(os.path.join(root, STORE_DIR))
+
+    def get_names(self):
+        if not self.scan:
+            return NameAllocator()
+        return NameAllocator(self.root)
+
+    def prepare(self, fname, names):
+        if (os.path.dirname(os.path.normpath(fname))
+                != os.path.normpath(self.root)):
+            make_entry_dirs(self.root, fname, names)
+
+    def write(self, content, fname):
+        if self.store is not None:
+            self.store.save(content, fname)
+        else:
+            write(content, fname)
+
+    def format_stats(self):
+        if self.store is None:
+            return None
+        return self.store.format_stats()
+
+
+class MemorySink(Sink):
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+
+    def write(self, content, fname):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        elif not isinstance(content, bytes):
+            content = b''.join(content)
+        self.files[fname] = content
+
+
+class ArchiveSink(Sink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.path = path
+
+    def get_name(self, fname):
+        return os.path.relpath(fname, self.path).replace(os.sep, '/')
+
+    def spool(self, content, hash_=None):
+        fp = SpooledTemporaryFile(SPOOL_SIZE)
+        try:
+            for chunk in content:
+                if hash_ is not None:
+                    hash_.update(chunk)
+                fp.write(chunk)
+            fp.seek(0)
+        except (ValueError, IOError):
+            fp.close()
+            raise
+        return fp
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class ZipSink(ArchiveSink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, content, fname):
+        name = self.get_name(fname)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if isinstance(content, bytes):
+            self.zip.writestr(name, content)
+            return
+        with self.spool(content) as src:
+            with self.zip.open(name, 'w', force_zip64=True) as fp:
+                shutil.copyfileobj(src, fp, BASE64_CHUNK_SIZE)
+
+    def close(self):
+        self.zip.close()
+
+
+class TarSink(ArchiveSink):
+    def __init__(self, path, mode, dedupe=False):
+        super().__init__(path)
+        self.tar = tarfile.open(path, mode)
+        self.mtime = time.time()
+        self.digests = {} if dedupe else None
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def get_info(self, fname):
+        info = tarfile.TarInfo(self.get_name(fname))
+        info.mtime = self.mtime
+        info.mode = 0o644
+        return info
+
+    def link(self, digest, info, size):
+        target = self.digests.get(digest)
+        if target is None:
+            return False
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        self.tar.addfile(info)
+        self.duplicates += 1
+        self.bytes_saved += size
+        return True
+
+    def write(self, content, fname):
+        info = self.get_info(fname)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if isinstance(content, bytes):
+            digest = None
+            if self.digests is not None:
+                digest = sha256(content).hexdigest()
+                if self.link(digest, info, len(content)):
+                    return
+            info.size = len(content)
+            self.tar.addfile(info, BytesIO(content))
+        else:
+            hash_ = sha256() if self.digests is not None else None
+            with self.spool(content, hash_) as fp:
+                fp.seek(0, os.SEEK_END)
+                info.size = fp.tell()
+                fp.seek(0)
+                digest = None if hash_ is None else hash_.hexdigest()
+                if digest is not None and self.link(digest, info, info.size):
+                    return
+                self.tar.addfile(info, fp)
+        if digest is not None:
+            self.digests.setdefault(digest, info.name)
+
+    def close(self):
+        self.tar.close()
+
+    def format_stats(self):
+        if self.digests is None:
+            return None
+        return '%d duplicates, %s saved' % (self.duplicates,
+                                            format_size(self.bytes_saved))
+
+
+class SqliteSink(ArchiveSink):
+    def __init__(self, path, batch_size=SQLITE_BATCH_SIZE):
+        if sqlite3 is None:
+            raise ValueError('sqlite output is not supported')
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.rows = 0
+        self.digests = {}
+        self.duplicates = 0
+        self.bytes_saved = 0
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            self.db = sqlite3.connect(path, isolation_level=None,
+                                      check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.executescript(SQLITE_SCHEMA)
+            self.db.execute('BEGIN')
+        except sqlite3.Error as err:
+            raise IOError('Could not open "%s": %s' % (path, err))
+
+    def write(self, content, fname):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        elif not isinstance(content, bytes):
+            content = b''.join(content)
+        digest = sha256(content).hexdigest()
+        try:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO bodies (sha256, size, data)'
+                ' VALUES (?, ?, ?)',
+                (digest, len(content), content)
+            )
+        except sqlite3.Error as err:
+            raise IOError(err)
+        if not cursor.rowcount:
+            self.duplicates += 1
+            self.bytes_saved += len(content)
+        self.digests[fname] = digest
+
+    def record(self, result):
+        entry = result.entry
+        request = entry.get('request', {})
+        response = entry.get('response', {})
+        content = response.get('content', {})
+        url = request.get('url')
+        digest = None
+        name = None
+        if result.path is not None:
+            digest = self.digests.pop(result.path, None)
+            if digest is not None:
+                name = self.get_name(result.path)
+        timings = entry.get('timings')
+        if timings is not None:
+            timings = json.dumps(timings, default=float)
+        try:
+            self.db.execute(
+                'INSERT INTO entries (method, url, host, status, status_text,'
+                ' mime, size, started, time, timings, name, sha256)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (request.get('method'), url,
+                 urlparse(url).netloc if isinstance(url, str) else None,
+                 get_number(response.get('status')),
+                 response.get('statusText'), content.get('mimeType'),
+                 get_number(content.get('size')),
+                 entry.get('startedDateTime'), get_number(entry.get('time')),
+                 timings, name, digest)
+            )
+            self.rows += 1
+            if self.rows % self.batch_size == 0:
+                self.db.execute('COMMIT')
+                self.db.execute('BEGIN')
+        except sqlite3.Error as err:
+            raise IOError(err)
+
+    def close(self):
+        try:
+            self.db.execute('COMMIT')
+        finally:
+            self.db.close()
+
+    def format_stats(self):
+        return '%d entries, %d duplicates, %s saved' % (
+            self.rows, self.duplicates, format_size(self.bytes_saved)
+        )
+
+
+def get_number(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def is_database(fp):
+    if hasattr(fp, 'peek'):
+        return fp.peek(16)[:16] == SQLITE_MAGIC
+    return False
+
+def read_database(fname, entry_filter=None, bodies=True, indexed=False):
+    if sqlite3 is None:
+        raise ValueError('sqlite input is not supported')
+    try:
+        db = sqlite3.connect(fname)
+        try:
+            rows = db.execute(
+                'SELECT method, url, status, status_text, mime, size,'
+                ' started, time, timings, sha256 FROM entries ORDER BY id'
+            )
+            for index, row in enumerate(rows):
+                entry = database_entry(row)
+                if entry_filter is not None and not entry_filter.match(entry):
+                    continue
+                if row[9] is not None:
+                    text = '-'
+                    if bodies:
+                        text = db.execute(
+                            'SELECT data FROM bodies WHERE sha256 = ?',
+                            (row[9],)
+                        ).fetchone()[0]
+                    entry['response']['content']['text'] = text
+                if indexed:
+                    yield index, entry
+                else:
+                    yield entry
+        finally:
+            db.close()
+    except sqlite3.Error as err:
+        raise ValueError('%s: %s' % (fname, err))
+
+def database_entry(row):
+    method, url, status, status_text, mime, size, started, time_ = row[:8]
+    request = {}
+    response = {}
+    content = {}
+    entry = {'request': request, 'response': response}
+    for obj, key, value in ((request, 'method', method),
+                            (request, 'url', url),
+                            (response, 'status', status),
+                            (response, 'statusText', status_text),
+                            (content, 'mimeType', mime),
+                            (content, 'size', size),
+                            (entry, 'startedDateTime', started),
+                            (entry, 'time', time_)):
+        if value is not None:
+            obj[key] = value
+    if row[8] is not None:
+        entry['timings'] = json.loads(row[8])
+    response['content'] = content
+    return entry
+
+
+def get_archive_format(path):
+    name = path.lower()
+    for ext, mode in ARCHIVE_FORMATS:
+        if name.endswith(ext):
+            return mode
+    return None
+
+def open_archive(path, dedupe=False):
+    mode = get_archive_format(path)
+    if mode is None:
+        return None
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    if mode == 'zip':
+        return ZipSink(path)
+    if mode == 'sqlite':
+        return SqliteSink(path)
+    return TarSink(path, mode, dedupe)
+
+def list_entries(entries, fp=None, batch_size=LIST_BATCH_SIZE):
+    if fp is None:
+        fp = sys.stdout
+    lines = []
+    for entry in entries:
+        lines.append(format_entry(entry))
+        if len(lines) >= batch_size:
+            lines.append('')
+            fp.write('\n'.join(lines))
+            fp.flush()
+            lines = []
+    if lines:
+        lines.append('')
+        fp.write('\n'.join(lines))
+
+def get_entry_text(entry):
+    try:
+        content = entry['response']['content']
+    except KeyError:
+        return None
+    try:
+        text = content['text']
+        if not text:
+            return None
+    except KeyError:
+        return None
+
+    try:
+        encoding = content['encoding']
+        if encoding != 'base64':
+            raise ValueError(
+                '\tUnknown content encoding: "%s"' % encoding
+            )
+    except KeyError:
+        encoding = None
+
+    return text, encoding
+
+def b64decode_stream(chunks):
+    rest = ''
+    for chunk in chunks:
+        chunk = rest + BASE64_INVALID.sub('', chunk)
+        end = len(chunk) - len(chunk) % 4
+        rest = chunk[end:]
+        if end:
+            yield b64decode(chunk[:end])
+    if rest:
+        yield b64decode(rest)
+
+def b64decode_chunks(text, chunk_size=BASE64_CHUNK_SIZE):
+    chunk_size = max(chunk_size - chunk_size % 4, 4)
+    return b64decode_stream(text[i:i + chunk_size]
+                            for i in range(0, len(text), chunk_size))
+
+def get_escape_end(text):
+    end = text.rfind('\\', max(len(text) - 5, 0))
+    if end < 0:
+        return len(text)
+    start = end
+    while start > 0 and text[start - 1] == '\\':
+        start -= 1
+    if (end - start) % 2:
+        return len(text)
+    return end
+
+def join_surrogates(high, text):
+    if high:
+        text = (high + text[:1]).encode(
+            'utf-16-le', 'surrogatepass'
+        ).decode('utf-16-le', 'surrogatepass') + text[1:]
+    if text and '\ud800' <= text[-1] <= '\udbff':
+        return text[:-1], text[-1]
+    return text, ''
+
+
+class FileText(object):
+    def __init__(self, name, offset, length):
+        self.name = name
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, chunk_size=BASE64_CHUNK_SIZE):
+        with open(self.name, 'rb') as fp:
+            fp.seek(self.offset)
+            size = self.length
+            while size > 0:
+                data = fp.read(min(chunk_size, size))
+                if not data:
+                    raise ValueError('Unterminated string at offset %d'
+                                     % self.offset)
+                size -= len(data)
+                yield data
+
+    def chunks(self, chunk_size=BASE64_CHUNK_SIZE):
+        decoder = getincrementaldecoder('utf-8')()
+        blocks = self.read(chunk_size)
+        rest = ''
+        high = ''
+        final = False
+        while not final:
+            data = next(blocks, None)
+            final = data is None
+            text = rest + decoder.decode(data or b'', final)
+            end = len(text) if final else get_escape_end(text)
+            text, rest = text[:end], text[end:]
+            if '\\' in text:
+                text = json.loads('"%s"' % text)
+            text, high = join_surrogates(high, text)
+            if final:
+                text += high
+            if text:
+                yield text
+
+
+class Base64Stream(object):
+    def __init__(self, text, chunk_size=BASE64_CHUNK_SIZE):
+        self.text = text
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        if isinstance(self.text, FileText):
+            return b64decode_stream(self.text.chunks(self.chunk_size))
+        return b64decode_chunks(self.text, self.chunk_size)
+
+
+class TextStream(object):
+    def __init__(self, text, chunk_size=BASE64_CHUNK_SIZE):
+        self.text = text
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for chunk in self.text.chunks(self.chunk_size):
+            yield chunk.encode('utf-8')
+
+
+def decode_content(text, encoding, chunk_size=None):
+    if isinstance(text, FileText):
+        if encoding == 'base64':
+            return Base64Stream(text, chunk_size or BASE64_CHUNK_SIZE)
+        return TextStream(text, chunk_size or BASE64_CHUNK_SIZE)
+    if encoding == 'base64':
+        if chunk_size and len(text) > chunk_size:
+            return Base64Stream(text, chunk_size)
+        return b64decode(text)
+    return text
+
+def get_entry_content(entry):
+    text = get_entry_text(entry)
+    if text is None:
+        return None
+    return decode_content(*text)
+
+def get_entry_path(entry, subdirs=False):
+    try:
+        url = urlparse(entry['request']['url'])
+    except KeyError:
+        raise ValueError('Invalid entry: missing request URL: %s' % repr(entry))
+
+    fname = url.path.strip('/')
+    if fname == '':
+        fname = 'index.html'
+
+    if subdirs:
+        return os.path.join(url.netloc, fname)
+    return os.path.basename(fname)
+
+def get_compression(fp):
+    if hasattr(fp, 'peek'):
+        magic = fp.peek(6)[:6]
+    elif fp.seekable():
+        pos = fp.tell()
+        magic = fp.read(6)
+        fp.seek(pos)
+    else:
+        return None
+    for compression, prefix in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+def decompress(fp):
+    compression = get_compression(fp)
+    if compression is None:
+        return fp
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fp, mode='rb')
+    if compression == 'bzip2' and bz2 is not None:
+        return bz2.BZ2File(fp, 'rb')
+    if compression == 'xz' and lzma is not None:
+        return lzma.LZMAFile(fp, 'rb')
+    raise ValueError('%s compression is not supported' % compression)
+
+def map_file(fp):
+    if not isinstance(fp, (BufferedReader, FileIO)):
+        return None
+    try:
+        fileno = fp.fileno()
+        offset = fp.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+    try:
+        data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    return data, offset
+
+def loads(data):
+    if json_backend is None:
+        return json.loads(data)
+    try:
+        return json_backend.loads(data)
+    except ValueError:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+def load_json(fp):
+    mapped = None
+    if json_backend is not None and json_backend.__name__ == 'orjson':
+        mapped = map_file(fp)
+    if mapped is None:
+        return loads(fp.read())
+    data, offset = mapped
+    try:
+        with memoryview(data) as view:
+            with view[offset:] as buf:
+                return loads(buf)
+    finally:
+        data.close()
+
+def get_input_size(fp):
+    try:
+        info = os.fstat(fp.fileno())
+        pos = fp.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(info.st_mode):
+        return None
+    size = info.st_size - pos
+    compression = get_compression(fp)
+    if compression is None:
+        return size
+    if compression == 'gzip' and size >= 4:
+        fp.seek(-4, os.SEEK_END)
+        isize = struct.unpack('<I', fp.read(4))[0]
+        fp.seek(pos)
+        if isize < size:
+            isize += (size - isize + 0xffffffff) & ~0xffffffff
+        return isize
+    return size * COMPRESSION_RATIO
+
+def get_available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def get_iterative(fp, iterative=None, max_memory=None):
+    if iterative is None:
+        iterative = AUTO if max_memory is not None else False
+    if iterative != AUTO:
+        return iterative
+    if ijson is None:
+        return False
+    if fp is sys.stdin:
+        return True
+    size = get_input_size(fp)
+    if size is None:
+        return True
+    if max_memory is None:
+        max_memory = get_available_memory()
+        if max_memory is None:
+            return False
+    factor = FULL_LOAD_FACTOR
+    if getattr(json_backend, '__name__', None) == 'orjson':
+        factor = FAST_FULL_LOAD_FACTOR
+    return size * factor > max_memory
+
+def get_entries(fp, iterative=True):
+    if fp is sys.stdin:
+        iterative = True
+        fp = fp.buffer
+    fp = decompress(fp)
+
+    if iterative and isinstance(fp, (BufferedReader, FileIO)):
+        return (entry for _, entry in scan_selected_entries(fp))
+    if ijson is None or not iterative:
+        return load_json(fp)['log']['entries']
+    else:
+        return ijson.items(fp, 'log.entries.item')
+
+def is_escaped(buf, pos):
+    start = pos
+    while pos > 0 and buf[pos - 1] == 0x5c:
+        pos -= 1
+    return (start - pos) % 2 == 1
+
+def skip_values(fp, skip_keys=SCAN_SKIP_KEYS, block_size=SCAN_BLOCK_SIZE,
+                spans=None):
+    offset = 0
+    if not skip_keys:
+        while True:
+            buf = fp.read(block_size)
+            if not buf:
+                return
+            yield buf, [(0, offset)], len(buf) == block_size
+            offset += len(buf)
+
+    key = re.compile(b'"(?:%s)"[ \\t\\n\\r]*:[ \\t\\n\\r]*"'
+                     % b'|'.join(re.escape(key) for key in skip_keys))
+    buf = b''
+    skipping = False
+    skipped = False
+    start = 0
+    eof = False
+    while not eof:
+        data = fp.read(block_size)
+        eof = not data
+        full = len(data) == block_size
+        buf += data
+        parts = []
+        segments = []
+        size = 0
+        pos = 0
+        while True:
+            if skipping:
+                end = SCAN_STRING.match(buf, pos).end()
+                skipped = skipped or end > pos
+                pos = end
+                if end == len(buf) or buf[end] == 0x5c:
+                    break
+                part = SCAN_SKIPPED[1:] if skipped else b'"'
+                if skipped and spans is not None:
+                    spans.append((start, offset + end))
+                parts.append(part)
+                size += len(part)
+                pos += 1
+                skipping = False
+                continue
+            match = key.search(buf, pos)
+            while match is not None and is_escaped(buf, match.start()):
+                match = key.search(buf, match.start() + 1)
+            if match is not None:
+                end = match.end()
+                skipping = True
+                skipped = False
+                start = offset + end
+            elif eof:
+                end = len(buf)
+            else:
+                end = max(pos, len(buf) - SCAN_KEEP)
+            segments.append((size, offset + pos))
+            parts.append(buf[pos:end])
+            size += end - pos
+            pos = end
+            if match is None:
+                break
+        if parts:
+            yield b''.join(parts), segments, full
+        buf = buf[pos:]
+        offset += pos
+
+
+class ScanBuffer(object):
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.decoder = json.JSONDecoder()
+        self.data = ''
+        self.start = 0
+        self.positions = []
+        self.offsets = []
+        self.full = False
+        self.eof = False
+
+    def end(self):
+        return self.start + len(self.data)
+
+    def read(self, pos):
+        if self.eof:
+            return False
+        try:
+            data, segments, self.full = next(self.blocks)
+        except StopIteration:
+            self.eof = True
+            return False
+        end = self.end()
+        self.data = self.data[pos - self.start:] + data.decode('latin-1')
+        self.start = pos
+        i = bisect_right(self.positions, pos) - 1
+        if i > 0:
+            del self.positions[:i]
+            del self.offsets[:i]
+        for rel, offset in segments:
+            self.positions.append(end + rel)
+            self.offsets.append(offset)
+        return True
+
+    def get_offset(self, pos):
+        i = bisect_right(self.positions, pos) - 1
+        return self.offsets[i] + pos - self.positions[i]
+
+    def skip(self, pos):
+        while True:
+            pos = self.start + SCAN_WHITESPACE.match(
+                self.data, pos - self.start
+            ).end()
+            if pos < self.end():
+                return pos, self.data[pos - self.start]
+            if not self.read(pos):
+                return pos, ''
+
+    def decode(self, pos):
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.data,
+                                                     pos - self.start)
+                end += self.start
+                if (self.eof or self.data[pos - self.start] in '{["'
+                        or (end < self.end()
+                            and self.data[end - self.start] not in '.eE')):
+                    return value, end
+            except json.JSONDecodeError as err:
+                if (err.pos < len(self.data) - SCAN_KEEP
+                        and not err.msg.startswith('Unterminated')):
+                    raise ValueError('%s at offset %d' % (
+                        err.msg, self.get_offset(self.start + err.pos)
+                    ))
+                if self.eof:
+                    raise EOFError()
+            size = 2 * (self.end() - pos)
+            while (self.read(pos) and self.full
+                   and self.end() - pos < size):
+                pass
+
+    def find(self, pos, name):
+        while True:
+            pos, char = self.skip(pos)
+            if char == ',':
+                pos += 1
+                continue
+            if char != '"':
+                return None
+            key, pos = self.decode(pos)
+            pos, char = self.skip(pos)
+            if not char:
+                return None
+            if char != ':':
+                raise ValueError('Expecting \':\' at offset %d'
+                                 % self.get_offset(pos))
+            pos += 1
+            if key == name:
+                return pos
+            pos, _ = self.skip(pos)
+            _, pos = self.decode(pos)
+
+    def enter(self, pos, char):
+        pos, found = self.skip(pos)
+        if found == '\xef' and self.data.startswith('\xef\xbb\xbf'):
+            pos, found = self.skip(pos + 3)
+        if found != char:
+            return None
+        return pos + 1
+
+
+def scan_items(fp, skip_keys=SCAN_SKIP_KEYS, block_size=SCAN_BLOCK_SIZE,
+               spans=None):
+    buf = ScanBuffer(skip_values(fp, skip_keys, block_size, spans))
+    try:
+        pos = buf.enter(0, '{')
+        for key, char in (('log', '{'), ('entries', '[')):
+            if pos is None:
+                return
+            pos = buf.find(pos, key)
+            if pos is not None:
+                pos = buf.enter(pos, char)
+        if pos is None:
+            return
+        while True:
+            pos, char = buf.skip(pos)
+            if char == ',':
+                pos += 1
+                continue
+            if char == ']' or not char:
+                return
+            value, end = buf.decode(pos)
+            if char == '{':
+                start = buf.get_offset(pos)
+                data = buf.data[pos - buf.start:end - buf.start]
+                data = data.encode('latin-1')
+                if not data.isascii():
+                    value = json.loads(data)
+                yield start, buf.get_offset(end - 1) + 1 - start, data, value
+            pos = end
+    except EOFError:
+        return
+
+def scan_entries(fp, skip_keys=SCAN_SKIP_KEYS, block_size=SCAN_BLOCK_SIZE):
+    for offset, length, skeleton, _ in scan_items(fp, skip_keys, block_size):
+        yield offset, length, skeleton
+
+def get_index_path(fname):
+    return fname + INDEX_EXT
+
+def index_row(offset, length, entry):
+    request = entry.get('request', {})
+    response = entry.get('response', {})
+    content = response.get('content', {})
+    return [
+        offset, length,
+        request.get('method'),
+        request.get('url'),
+        response.get('status'),
+        response.get('statusText'),
+        content.get('mimeType'),
+        content.get('size')
+    ]
+
+def index_entry(row):
+    method, url, status, status_text, mime, size = row[2:8]
+    request = {}
+    response = {}
+    content = {}
+    if method is not None:
+        request['method'] = method
+    if url is not None:
+        request['url'] = url
+    if status is not None:
+        response['status'] = status
+    if status_text is not None:
+        response['statusText'] = status_text
+    if mime is not None:
+        content['mimeType'] = mime
+    if size is not None:
+        content['size'] = size
+    response['content'] = content
+    return {'request': request, 'response': response}
+
+def make_index(fname):
+    if fname == STDIN:
+        raise ValueError('Can not index standard input')
+    path = get_index_path(fname)
+    tmp = path + '.tmp'
+    stat = os.stat(fname)
+    ret = 0
+    with open(fname, 'rb') as fp:
+        if get_compression(fp) is not None:
+            raise ValueError('Can not index compressed file "%s"' % fname)
+        with open(tmp, 'w') as out:
+            json.dump({
+                'version': INDEX_VERSION,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns
+            }, out)
+            out.write('\n')
+            for offset, length, _, entry in scan_items(fp):
+                row = index_row(offset, length, entry)
+                out.write(json.dumps(row, separators=(',', ':')))
+                out.write('\n')
+                ret += 1
+    os.replace(tmp, path)
+    return ret
+
+def iter_index(fp):
+    with fp:
+        for line in fp:
+            yield json.loads(line)
+
+def read_index(fname):
+    if fname == STDIN:
+        return None
     try:
-        content = entry['response']['content']
-    except KeyError:
+        fp = open(get_index_path(fname))
+    except (OSError, IOError):
         return None
     try:
-        text = content['text']
-        if not text:
-            return None
-    except KeyError:
+        header = json.loads(fp.readline())
+        stat = os.stat(fname)
+        valid = (header['version'] == INDEX_VERSION
+                 and header['size'] == stat.st_size
+                 and header['mtime'] == stat.st_mtime_ns)
+    except (ValueError, TypeError, KeyError, OSError):
+        valid = False
+    if not valid:
+        fp.close()
         return None
+    return iter_index(fp)
 
-    try:
-        if content['encoding'] == 'base64':
-            text = b64decode(text)
-        else:
-            raise ValueError(
-                '\tUnknown content encoding: "%s"' % content['encoding']
-            )
-    except KeyError:
-        pass
+def get_indexed_entries(fp, rows, entry_filter=None):
+    for index, row in enumerate(rows):
+        if (entry_filter is not None
+                and not entry_filter.match(index_entry(row))):
+            continue
+        fp.seek(row[0])
+        yield index, json.loads(fp.read(row[1]))
 
-    return text
 
-def get_entry_path(entry, subdirs=False):
+def parse_size(value):
+    match = re.match(r'^\s*([0-9]*\.?[0-9]+)\s*([%s]?)\s*$' % SIZE_UNITS,
+                     value.upper())
+    if match is None:
+        raise ValueError('Invalid size: "%s"' % value)
+    size = float(match.group(1))
+    if match.group(2):
+        size *= 1024 ** SIZE_UNITS.index(match.group(2))
+    return int(size)
+
+def parse_regex(value):
     try:
-        url = urlparse(entry['request']['url'])
-    except KeyError:
-        raise ValueError('Invalid entry: missing request URL: %s' % repr(entry))
+        return re.compile(value)
+    except re.error as err:
+        raise ValueError('Invalid regular expression: "%s": %s'
+                         % (value, err))
 
-    fname = url.path.strip('/')
-    if fname == '':
-        fname = 'index.html'
+def parse_shard(value):
+    match = re.match(r'^\s*([0-9]+)\s*(?::\s*([0-9]+))?\s*$', value)
+    if match is None:
+        raise ValueError('Invalid shard layout: "%s"' % value)
+    depth = int(match.group(1))
+    width = SHARD_WIDTH
+    if match.group(2) is not None:
+        width = int(match.group(2))
+    if depth < 1 or width < 1 or depth * width > 64:
+        raise ValueError('Invalid shard layout: "%s"' % value)
+    return depth, width
 
-    if subdirs:
-        return os.path.join(url.netloc, fname)
-    return os.path.basename(fname)
+def parse_status(value):
+    ret = []
+    for item in value.split(','):
+        item = item.strip().lower()
+        try:
+            if item.endswith('xx') and len(item) == 3:
+                start = int(item[0]) * 100
+                ret.append((start, start + 99))
+            elif '-' in item:
+                start, end = item.split('-', 1)
+                ret.append((int(start), int(end)))
+            else:
+                ret.append((int(item), int(item)))
+        except ValueError:
+            raise ValueError('Invalid status range: "%s"' % item)
+    return ret
 
-def get_entries(fp, iterative=True):
+
+class EntryFilter(object):
+    def __init__(self, url=None, host=None, mime=None, status=None,
+                 min_size=None, max_size=None):
+        self.url = None
+        self.host = None
+        self.mime = None
+        self.status = None
+        self.min_size = min_size
+        self.max_size = max_size
+        if url is not None:
+            self.url = re.compile(url)
+        if host:
+            self.host = set(item.lower() for item in host)
+        if mime:
+            self.mime = re.compile('|'.join(
+                fnmatch.translate(item.lower()) for item in mime
+            ))
+        if isinstance(status, str):
+            self.status = parse_status(status)
+        elif status is not None:
+            self.status = list(status)
+
+    def match(self, entry):
+        response = entry.get('response', {})
+        if self.status is not None:
+            status = response.get('status')
+            if not isinstance(status, int) or not any(
+                    start <= status <= end for start, end in self.status
+            ):
+                return False
+
+        content = response.get('content', {})
+        if self.min_size is not None or self.max_size is not None:
+            size = content.get('size', -1)
+            if not isinstance(size, int) or size < 0:
+                return False
+            if self.min_size is not None and size < self.min_size:
+                return False
+            if self.max_size is not None and size > self.max_size:
+                return False
+
+        if self.mime is not None:
+            mime = content.get('mimeType')
+            if mime is None:
+                return False
+            mime = mime.split(';', 1)[0].strip().lower()
+            if self.mime.match(mime) is None:
+                return False
+
+        if self.url is not None or self.host is not None:
+            url = entry.get('request', {}).get('url')
+            if url is None:
+                return False
+            if self.host is not None:
+                try:
+                    host = urlparse(url).hostname
+                except ValueError:
+                    return False
+                if host not in self.host:
+                    return False
+            if self.url is not None and self.url.search(url) is None:
+                return False
+
+        return True
+
+
+def select_entries(fp, entry_filter, iterative=True):
+    if (fp is not sys.stdin and iterative and fp.seekable()
+            and get_compression(fp) is None):
+        return scan_selected_entries(fp, entry_filter)
+    return enumerate_entries(get_entries(fp, iterative), entry_filter)
+
+def enumerate_entries(entries, entry_filter=None):
+    for index, entry in enumerate(entries):
+        if entry_filter is None or entry_filter.match(entry):
+            yield index, entry
+
+def get_metadata(fp):
     if fp is sys.stdin:
-        iterative = True
         fp = fp.buffer
+    fp = decompress(fp)
+    for _, _, _, entry in scan_items(fp):
+        yield entry
 
-    if ijson is None or not iterative:
-        data = fp.read()
-        if isinstance(data, bytes):
-            data = data.decode('utf-8')
-        data = json.loads(data)
-        return data['log']['entries']
+def get_text_refs(value, refs):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'text' and item == '-':
+                refs.append((value, key))
+            else:
+                get_text_refs(item, refs)
+    elif isinstance(value, list):
+        for item in value:
+            get_text_refs(item, refs)
+    return refs
+
+def read_span(fp, offset, length):
+    pos = fp.tell()
+    fp.seek(offset)
+    data = fp.read(length)
+    fp.seek(pos)
+    return data
+
+def restore_texts(fp, entry, texts):
+    response = entry.get('response')
+    content = None
+    if isinstance(response, dict):
+        content = response.get('content')
+    refs = get_text_refs(entry, [])
+    if (len(refs) != len(texts)
+            or not any(obj is content and end - start > BASE64_CHUNK_SIZE
+                       for (obj, _), (start, end) in zip(refs, texts))):
+        return False
+    for (obj, key), (start, end) in zip(refs, texts):
+        if obj is content and end - start > BASE64_CHUNK_SIZE:
+            obj[key] = FileText(fp.name, start, end - start)
+        else:
+            obj[key] = json.loads(b'"%s"' % read_span(fp, start, end - start))
+    return True
+
+def scan_selected_entries(fp, entry_filter=None):
+    base = fp.tell()
+    spans = None
+    if isinstance(fp, (BufferedReader, FileIO)) and isinstance(fp.name, str):
+        spans = deque()
+    items = scan_items(fp, spans=spans)
+    for index, (offset, length, _, entry) in enumerate(items):
+        texts = []
+        while spans and spans[0][0] < offset + length:
+            start, end = spans.popleft()
+            if start >= offset:
+                texts.append((base + start, base + end))
+        if entry_filter is not None and not entry_filter.match(entry):
+            continue
+        if not restore_texts(fp, entry, texts):
+            entry = json.loads(read_span(fp, base + offset, length))
+        yield index, entry
+
+
+class FollowReader(object):
+    def __init__(self, fp, interval=FOLLOW_INTERVAL):
+        self.fp = fp
+        self.interval = interval
+        self.pipe = not fp.seekable()
+
+    def read(self, size=-1):
+        try:
+            while True:
+                if hasattr(self.fp, 'read1'):
+                    data = self.fp.read1(size)
+                else:
+                    data = self.fp.read(size)
+                if data or self.pipe:
+                    return data
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            return b''
+
+def read_lines(fp, block_size=SCAN_BLOCK_SIZE):
+    parts = []
+    while True:
+        buf = fp.read(block_size)
+        if not buf:
+            break
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                parts.append(buf[start:])
+                break
+            parts.append(buf[start:end])
+            yield b''.join(parts)
+            parts = []
+            start = end + 1
+    if parts:
+        yield b''.join(parts)
+
+def follow_entries(fp, fmt='ndjson', exit_on_error=True,
+                   interval=FOLLOW_INTERVAL):
+    if fp is sys.stdin:
+        fp = fp.buffer
+    fp = FollowReader(fp, interval)
+    if fmt == 'har':
+        items = (data for _, _, data in scan_entries(fp, ()))
     else:
-        return ijson.items(fp, 'log.entries.item')
+        items = (line for line in read_lines(fp) if line.strip())
+    for data in items:
+        try:
+            entry = json.loads(data.decode('utf-8'))
+            if not isinstance(entry, dict):
+                raise ValueError('not an object')
+        except ValueError as err:
+            msg = 'Invalid entry: %s: %s' % (repr(data[:80]), repr(err))
+            report_error(msg, ValueError, exit_on_error)
+            continue
+        yield entry
+
 
 def get_out_dir(path, default):
     if not path:
         return default
+    if get_archive_format(path) is not None and not os.path.isdir(path):
+        return path
     if os.path.exists(path):
         if not os.path.isdir(path):
             raise ValueError('"%s" is not a directory' % path)
         return os.path.join(path, default)
     return path
 
+def get_resume_dir(path, outdir):
+    if path and os.path.exists(os.path.join(path, JOURNAL_NAME)):
+        return path
+    return outdir
+
 def dirnames(entry, root):
     path = os.path.relpath(entry, root)
     ret = []
@@ -144,79 +2033,987 @@ def dirnames(entry, root):
         path = os.path.dirname(path)
     return ret
 
-def move_files_to_dir(path, first):
+def index_names(path, names=None):
+    for i in count():
+        if i:
+            fname = os.path.join(path, 'index.%d.html' % i)
+        else:
+            fname = os.path.join(path, 'index.html')
+        if names is None or not names.exists(fname):
+            yield fname
+
+def move_files_to_dir(path, first, names=None):
     dirname, name = os.path.split(path)
     name, ext = os.path.splitext(name)
-    shutil.move(first, os.path.join(path, 'index.html'))
+    targets = index_names(path, names)
+    fname = next(targets)
+    shutil.move(first, fname)
+    if names is not None:
+        names.rename(first, fname)
     for i in count(1):
         fpath = os.path.join(dirname, '%s.%d%s' % (name, i, ext))
         if not os.path.exists(fpath):
             return
-        fname = 'index.%d.html' % i
-        shutil.move(fpath, os.path.join(path, fname))
+        fname = next(targets)
+        shutil.move(fpath, fname)
+        if names is not None:
+            names.rename(fpath, fname)
 
-def make_entry_dirs(root, entry):
-    try:
-        os.makedirs(os.path.dirname(entry), exist_ok=True)
+def make_entry_dirs(root, entry, names=None):
+    dirname = os.path.dirname(entry)
+    if names is not None and names.is_dir(dirname):
         return
+    try:
+        os.makedirs(dirname, exist_ok=True)
     except OSError:
         for path in reversed(dirnames(entry, root)):
+            if names is not None and names.is_dir(path):
+                continue
             if not os.path.exists(path):
                 os.mkdir(path)
             elif not os.path.isdir(path):
-                tmp = get_unused_name(path)
+                if names is not None:
+                    tmp = names.claim(path)
+                else:
+                    tmp = get_unused_name(path)
                 shutil.move(path, tmp)
+                if names is not None and names.on_rename is not None:
+                    names.on_rename(path, tmp)
                 os.mkdir(path)
-                move_files_to_dir(path, tmp)
-
-
-def extract(entries, outdir=None,
-            subdirs=False, verbose=False, exit_on_error=True):
-    if outdir is not None:
-        os.makedirs(outdir, exist_ok=True)
+                move_files_to_dir(path, tmp, names)
+    if names is not None:
+        names.add_dir(dirname)
 
+def plan_layout(entries, outdir, subdirs=False, ignore=(), naming=None):
+    paths = []
     for entry in entries:
         try:
-            if verbose or outdir is None:
-                print(format_entry(entry))
+            if get_entry_text(entry) is None:
+                paths.append(None)
+                continue
+            if naming is not None:
+                fname = naming(entry)
+            else:
+                fname = get_entry_path(entry, subdirs)
+            paths.append(os.path.join(outdir, fname))
+        except ValueError:
+            paths.append(None)
+
+    names = NameAllocator(outdir)
+    for path in ignore:
+        names.release(path)
+    if subdirs or naming is not None:
+        for path in paths:
+            if path is not None:
+                names.add_dir(os.path.dirname(path))
+
+    ret = []
+    for path in paths:
+        if path is not None:
+            if (subdirs or naming is not None) and names.is_dir(path):
+                path = os.path.join(path, 'index.html')
+            path = names.claim(path)
+        ret.append(path)
+    return ret
+
+def replay_move(src, dst, names, files, paths):
+    src = os.path.normpath(src)
+    if src in files:
+        moved = [(src, dst)]
+    else:
+        prefix = os.path.join(src, '')
+        moved = [(key, os.path.join(dst, key[len(prefix):]))
+                 for key in files if key.startswith(prefix)]
+    for key, path in moved:
+        index = files.pop(key)
+        files[os.path.normpath(path)] = index
+        if index is not None:
+            paths[index] = path
+
+def replay_entry_dirs(root, entry, names, files, paths):
+    dirname = os.path.dirname(entry)
+    if names.is_dir(dirname):
+        return
+    for path in reversed(dirnames(entry, root)):
+        if names.is_dir(path) or os.path.normpath(path) not in files:
+            continue
+        tmp = names.claim(path)
+        replay_move(path, tmp, names, files, paths)
+        dirname_, name = os.path.split(path)
+        name, ext = os.path.splitext(name)
+        targets = index_names(path, names)
+        fname = next(targets)
+        replay_move(tmp, fname, names, files, paths)
+        names.rename(tmp, fname)
+        for i in count(1):
+            fpath = os.path.join(dirname_, '%s.%d%s' % (name, i, ext))
+            key = os.path.normpath(fpath)
+            if key not in files and not names.is_dir(key):
+                break
+            fname = next(targets)
+            replay_move(fpath, fname, names, files, paths)
+            names.rename(fpath, fname)
+    names.add_dir(dirname)
 
-            if outdir is None:
+def replay_layout(entries, outdir, subdirs=False, naming=None):
+    names = NameAllocator(outdir)
+    files = dict.fromkeys(names.used - names.dirs)
+    root = os.path.normpath(outdir)
+    paths = []
+    for index, entry in enumerate(entries):
+        try:
+            if get_entry_text(entry) is None:
+                paths.append(None)
                 continue
+            if naming is not None:
+                fname = os.path.join(outdir, naming(entry))
+            else:
+                fname = os.path.join(outdir, get_entry_path(entry, subdirs))
+        except ValueError:
+            paths.append(None)
+            continue
+        fname = names.claim(fname)
+        if os.path.dirname(os.path.normpath(fname)) != root:
+            replay_entry_dirs(outdir, fname, names, files, paths)
+        files[os.path.normpath(fname)] = index
+        paths.append(fname)
+    return paths
+
+def read_layout(fp, outdir, subdirs=False, entry_filter=None, ignore=(),
+                naming=None, replay=False):
+    if fp is sys.stdin:
+        raise ValueError('Can not plan layout of standard input')
+    entries = get_metadata(fp)
+    if entry_filter is not None:
+        entries = filter(entry_filter.match, entries)
+    try:
+        if replay:
+            return replay_layout(entries, outdir, subdirs, naming)
+        return plan_layout(entries, outdir, subdirs, ignore, naming)
+    finally:
+        fp.seek(0)
+
+
+def report_error(msg, error, exit_on_error):
+    if exit_on_error:
+        raise error(msg)
+    print(msg, file=sys.stderr)
+
+def report_results(results, verbose=False, exit_on_error=True, manifest=None,
+                   shards=None):
+    for result in results:
+        if verbose:
+            print(format_entry(result.entry))
+            if result.status == 'empty':
+                print('\t----> <no content>')
+            elif result.status == 'done':
+                print('\t----> <done>', result.path)
+            elif result.path is not None:
+                print('\t---->', result.path)
+        if manifest is not None:
+            manifest.add(result)
+        if shards is not None:
+            shards.add(result)
+        if result.error is not None:
+            report_error(str(result.error), type(result.error),
+                         exit_on_error)
+
+def decode_entry(text, encoding, stats=None):
+    if stats is None:
+        return decode_content(text, encoding, BASE64_CHUNK_SIZE)
+    start = perf_counter()
+    content = decode_content(text, encoding, BASE64_CHUNK_SIZE)
+    if isinstance(content, (Base64Stream, TextStream)):
+        return StatsStream(content, stats)
+    stats.add('decode', perf_counter() - start, len(text), len(content))
+    return content
+
+def hash_content(content, hash_):
+    if isinstance(content, bytes):
+        hash_.update(content)
+    elif isinstance(content, str):
+        hash_.update(content.encode('utf-8'))
+    else:
+        return HashStream(content, hash_)
+    return content
+
+def save_entry(content, fname, sink, stats=None, hash_=None):
+    if stats is not None:
+        start = perf_counter()
+    data = content
+    if hash_ is not None:
+        data = hash_content(content, hash_)
+    sink.write(data, fname)
+    if stats is not None:
+        elapsed = perf_counter() - start
+        if isinstance(content, StatsStream):
+            elapsed -= content.elapsed
+            size = content.size
+        else:
+            size = len(content)
+        stats.add('write', elapsed, size, size)
+
+def write_entry(text, encoding, fname, sink, stats=None, hash_=None):
+    save_entry(decode_entry(text, encoding, stats), fname, sink, stats, hash_)
+
+def wait_entry(entry, fname, future):
+    try:
+        future.result()
+    except (OSError, IOError) as err:
+        return IOError('Could not write "%s": %s' % (fname, repr(err)))
+    except (KeyError, ValueError) as err:
+        return ValueError('Invalid entry: %s: %s' % (repr(entry), repr(err)))
+    return None
+
+def sibling_bases(path):
+    return tuple(base for base, _ in get_suffixes(path))
+
+def is_pending_dir(root, fname, pending):
+    root = os.path.normpath(root)
+    path = os.path.dirname(os.path.normpath(fname))
+    while path and path != root:
+        if path in pending:
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+class EntryResult(object):
+    def __init__(self, index, entry):
+        self.index = index
+        self.entry = entry
+        self.status = None
+        self.path = None
+        self.sha256 = None
+        self.size = None
+        self.error = None
+
+
+class Extractor(object):
+    def __init__(self, sink, subdirs=False, naming=None, entry_filter=None,
+                 jobs=1, digests=False, stats=None, layout=None,
+                 journal=None, cache=None):
+        self.sink = sink
+        self.subdirs = subdirs
+        self.naming = naming
+        self.entry_filter = entry_filter
+        self.jobs = jobs
+        self.digests = digests or journal is not None
+        self.stats = stats
+        self.layout = layout
+        self.journal = journal
+        self.cache = cache
+        self.names = sink.get_names()
+        if journal is not None:
+            self.names.on_rename = journal.move
+        if layout is not None:
+            for path in layout:
+                if path is not None:
+                    self.names.add(path)
+
+    def get_path(self, entry):
+        if self.naming is not None:
+            return self.naming(entry)
+        return get_entry_path(entry, self.subdirs)
+
+    def claim(self, fname):
+        if self.stats is None:
+            return self.names.claim(fname)
+        start = perf_counter()
+        ret = self.names.claim(fname)
+        self.stats.add('name', perf_counter() - start)
+        return ret
+
+    def prepare(self, fname):
+        if self.stats is None:
+            self.sink.prepare(fname, self.names)
+        else:
+            start = perf_counter()
+            self.sink.prepare(fname, self.names)
+            self.stats.add('mkdir', perf_counter() - start)
+
+    def start(self, result):
+        if self.journal is not None:
+            self.journal.start(result.index, result.path)
+        if self.digests:
+            return ContentHash()
+        return None
+
+    def finish(self, result, hash_):
+        result.status = 'written'
+        if hash_ is None:
+            return
+        result.sha256 = hash_.hexdigest()
+        result.size = hash_.size
+        if self.journal is not None:
+            self.journal.finish(result.index, result.path, result.sha256)
+
+    def fail(self, result, error):
+        if result.path is not None:
+            self.names.release(result.path)
+        result.status = 'error'
+        result.error = error
+
+    def write(self, text, encoding, fname, hash_=None):
+        if self.cache is None:
+            write_entry(text, encoding, fname, self.sink, self.stats, hash_)
+            return
+        key = self.cache.get_key(text, encoding)
+        if self.cache.get(key, fname, hash_):
+            return
+        write_entry(text, encoding, fname, self.sink, self.stats, hash_)
+        self.cache.put(key, fname)
+
+    def pending_keys(self, fname):
+        key = os.path.normpath(fname)
+        ret = (key,) + sibling_bases(key)
+        for path in dirnames(key, os.path.normpath(self.sink.root)):
+            ret += sibling_bases(path)
+        return ret
 
-            content = get_entry_content(entry)
+    def process(self, result, threaded=False, position=None):
+        if position is None:
+            position = result.index
+        entry = result.entry
+        try:
+            if self.journal is not None and result.index in self.journal.done:
+                result.status = 'done'
+                result.path, result.sha256 = self.journal.done[result.index]
+                return None
+
+            content = get_entry_text(entry)
             if content is None:
-                if verbose:
-                    print('\t----> <no content>')
-                continue
+                result.status = 'empty'
+                return None
 
-            fname = get_entry_path(entry, subdirs)
-            fname = os.path.join(outdir, fname)
-            fname = get_unused_name(fname)
-            if verbose:
-                print('\t---->', fname)
+            if not threaded and self.cache is None:
+                content = decode_entry(*content, self.stats)
 
+            fname = self.get_path(entry)
+            if self.layout is not None and self.layout[position]:
+                fname = self.layout[position]
+            else:
+                fname = self.claim(os.path.join(self.sink.root, fname))
+            result.path = fname
+
+            if threaded:
+                return content
             try:
-                if subdirs:
-                    make_entry_dirs(outdir, fname)
-                write(content, fname)
-            except (OSError, IOError) as err:
-                msg = 'Could not write "%s": %s' % (fname, repr(err))
-                if exit_on_error:
-                    raise IOError(msg)
+                self.prepare(fname)
+                hash_ = self.start(result)
+                if self.cache is None:
+                    save_entry(content, fname, self.sink, self.stats, hash_)
                 else:
-                    print(msg, file=sys.stderr)
+                    self.write(*content, fname, hash_)
+                self.finish(result, hash_)
+            except (OSError, IOError) as err:
+                self.fail(result, IOError(
+                    'Could not write "%s": %s' % (fname, repr(err))
+                ))
         except (KeyError, ValueError) as err:
-            msg = 'Invalid entry: %s: %s' % (repr(entry), repr(err))
-            if exit_on_error:
-                raise ValueError(msg)
+            self.fail(result, ValueError(
+                'Invalid entry: %s: %s' % (repr(entry), repr(err))
+            ))
+        return None
+
+    def extract(self, entries, indexed=False):
+        if self.stats is not None:
+            entries = self.stats.iterate(entries)
+        if not indexed:
+            entries = enumerate(entries)
+
+        pool = None
+        if self.jobs > 1 and self.sink.threaded:
+            pool = ThreadPoolExecutor(self.jobs)
+        pending = deque()
+        pending_paths = {}
+
+        def wait():
+            result, future, hash_ = pending.popleft()
+            if future is None:
+                self.sink.record(result)
+                return result
+            for key in self.pending_keys(result.path):
+                pending_paths[key] -= 1
+                if not pending_paths[key]:
+                    del pending_paths[key]
+            error = wait_entry(result.entry, result.path, future)
+            if error is None:
+                self.finish(result, hash_)
+            else:
+                self.fail(result, error)
+            self.sink.record(result)
+            return result
+
+        try:
+            for position, (index, entry) in enumerate(entries):
+                if (self.entry_filter is not None
+                        and not self.entry_filter.match(entry)):
+                    continue
+                result = EntryResult(index, entry)
+                content = self.process(result, pool is not None, position)
+                if content is not None:
+                    fname = result.path
+                    try:
+                        if is_pending_dir(self.sink.root, fname,
+                                          pending_paths):
+                            while pending:
+                                yield wait()
+                        self.prepare(fname)
+                    except (OSError, IOError) as err:
+                        self.fail(result, IOError(
+                            'Could not write "%s": %s' % (fname, repr(err))
+                        ))
+                        content = None
+                if content is None:
+                    pending.append((result, None, None))
+                else:
+                    hash_ = self.start(result)
+                    future = pool.submit(self.write, *content, fname, hash_)
+                    result.status = 'pending'
+                    pending.append((result, future, hash_))
+                    for key in self.pending_keys(fname):
+                        pending_paths[key] = pending_paths.get(key, 0) + 1
+                while pending and (pending[0][1] is None
+                                   or len(pending) > 4 * self.jobs):
+                    yield wait()
+
+            while pending:
+                yield wait()
+        finally:
+            if pool is not None:
+                for _, future, _ in pending:
+                    if future is not None:
+                        future.cancel()
+                pool.shutdown()
+
+
+def extract(entries, outdir=None,
+            subdirs=False, verbose=False, exit_on_error=True, jobs=1,
+            dedupe=False, stats=None, layout=None, resume=False,
+            manifest=None, cache=None, cache_size=CACHE_SIZE, shard=None,
+            indexed=False):
+    if outdir is None:
+        for entry in entries:
+            if indexed:
+                entry = entry[1]
+            print(format_entry(entry))
+        return
+
+    if cache is not None and get_archive_format(outdir) is not None:
+        raise ValueError('Can not use cache with archive output')
+    if shard is not None and get_archive_format(outdir) is not None:
+        raise ValueError('Can not shard archive output')
+
+    journal = None
+    sink = open_archive(outdir, dedupe)
+    if sink is not None and subdirs and layout is None:
+        if not isinstance(entries, list):
+            raise ValueError('Can not plan layout of streamed entries')
+        if indexed:
+            layout = replay_layout([entry for _, entry in entries],
+                                   outdir, subdirs)
+        else:
+            layout = replay_layout(entries, outdir, subdirs)
+    if sink is None:
+        if resume:
+            os.makedirs(outdir, exist_ok=True)
+            journal = Journal(os.path.join(outdir, JOURNAL_NAME))
+            journal.load()
+            journal.clean()
+            journal.open()
+        sink = FileSink(outdir, dedupe)
+    if cache is not None:
+        cache = BodyCache(cache, cache_size)
+    shards = None
+    naming = None
+    if shard is not None:
+        shards = ShardIndex(outdir, *shard)
+        shards.open(resume)
+        naming = shards.get_path
+
+    try:
+        extractor = Extractor(sink, subdirs, naming=naming, jobs=jobs,
+                              digests=manifest is not None, stats=stats,
+                              layout=layout, journal=journal, cache=cache)
+        results = extractor.extract(entries, indexed)
+        try:
+            report_results(results, verbose, exit_on_error, manifest, shards)
+        finally:
+            results.close()
+
+        if verbose and sink.format_stats() is not None:
+            print(sink.format_stats())
+        if cache is not None:
+            cache.evict()
+            if verbose:
+                print(cache.format_stats())
+    finally:
+        sink.close()
+        if journal is not None:
+            journal.close()
+        if shards is not None:
+            shards.close()
+
+
+def split_entries(fp, entry_filter=None):
+    if fp is sys.stdin or not fp.seekable():
+        raise ValueError('Can not split standard input')
+    if get_compression(fp) is not None:
+        raise ValueError('Can not split compressed input')
+    spans = []
+    entries = []
+    indexes = []
+    for index, (offset, length, _, entry) in enumerate(scan_items(fp)):
+        if entry_filter is None or entry_filter.match(entry):
+            spans.append((offset, length))
+            entries.append(entry)
+            indexes.append(index)
+    return spans, entries, indexes
+
+def get_chunks(spans, parts):
+    size = max(sum(length for _, length in spans) // parts, 1)
+    chunks = []
+    start = 0
+    chunk_size = 0
+    for end, (_, length) in enumerate(spans, 1):
+        chunk_size += length
+        if chunk_size >= size:
+            chunks.append((start, end))
+            start = end
+            chunk_size = 0
+    if start < len(spans):
+        chunks.append((start, len(spans)))
+    return chunks
+
+def extract_chunk(fname, outdir, spans, layout,
+                  subdirs=False, jobs=1, dedupe=False, digests=False,
+                  cache=None):
+    start = spans[0][0]
+    with open(fname, 'rb') as fp:
+        fp.seek(start)
+        data = fp.read(spans[-1][0] + spans[-1][1] - start)
+    entries = (loads(data[offset - start:offset - start + length])
+               for offset, length in spans)
+    sink = FileSink(outdir, dedupe, scan=False)
+    if cache is not None:
+        cache = BodyCache(cache, None)
+    extractor = Extractor(sink, subdirs, jobs=jobs, digests=digests,
+                          layout=layout, cache=cache)
+    results = []
+    for result in extractor.extract(entries):
+        result.entry = None
+        results.append(result)
+    store = None
+    if sink.store is not None:
+        store = (sink.store.objects, sink.store.duplicates,
+                 sink.store.bytes_saved, sink.store.inodes_saved)
+    if cache is not None:
+        cache = cache.get_stats()
+    return results, store, cache
+
+def extract_split(fp, outdir, processes,
+                  subdirs=False, verbose=False, exit_on_error=True, jobs=1,
+                  dedupe=False, entry_filter=None, stats=None,
+                  manifest=None, cache=None, cache_size=CACHE_SIZE,
+                  shard=None):
+    shards = None
+    naming = None
+    if shard is not None:
+        shards = ShardIndex(outdir, *shard)
+        naming = shards.get_path
+    if stats is not None:
+        start = perf_counter()
+    spans, entries, indexes = split_entries(fp, entry_filter)
+    layout = replay_layout(entries, outdir, subdirs, naming)
+    if stats is not None:
+        stats.add_time('name', perf_counter() - start)
+    if not spans:
+        return
+
+    sink = FileSink(outdir, dedupe)
+    body_cache = None
+    if cache is not None:
+        body_cache = BodyCache(cache, cache_size)
+    chunks = get_chunks(spans, processes * SPLIT_CHUNKS)
+    if shards is not None:
+        shards.open()
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(extract_chunk, fp.name, outdir,
+                        spans[start:end], layout[start:end],
+                        subdirs, jobs, dedupe, manifest is not None, cache)
+            for start, end in chunks
+        ]
+        try:
+            for (start, _), future in zip(chunks, futures):
+                results, store, cache_stats = future.result()
+                for result in results:
+                    position = start + result.index
+                    result.entry = entries[position]
+                    result.index = indexes[position]
+                if store is not None:
+                    sink.store.objects += store[0]
+                    sink.store.duplicates += store[1]
+                    sink.store.bytes_saved += store[2]
+                    sink.store.inodes_saved += store[3]
+                if cache_stats is not None:
+                    body_cache.add_stats(cache_stats)
+                if stats is not None:
+                    stats.entries += len(results)
+                report_results(results, verbose, exit_on_error, manifest,
+                               shards)
+        finally:
+            for future in futures:
+                future.cancel()
+            if shards is not None:
+                shards.close()
+
+    if verbose and sink.format_stats() is not None:
+        print(sink.format_stats())
+    if body_cache is not None:
+        body_cache.evict()
+        if verbose:
+            print(body_cache.format_stats())
+
+
+def wait_threadsafe(coro, loop, cancelled):
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    while True:
+        try:
+            return future.result(ASYNC_POLL_INTERVAL)
+        except FutureTimeoutError:
+            if cancelled.is_set():
+                future.cancel()
+                raise CancelledError()
+
+
+class AsyncReader(object):
+    def __init__(self, chunks, loop, cancelled):
+        self.chunks = chunks
+        self.loop = loop
+        self.cancelled = cancelled
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+
+    def next_chunk(self):
+        if self.eof:
+            return b''
+        chunk = wait_threadsafe(self.chunks.get(), self.loop, self.cancelled)
+        if chunk is None:
+            self.eof = True
+            return b''
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self.buf[self.pos:]]
+            while True:
+                chunk = self.next_chunk()
+                if not chunk:
+                    break
+                parts.append(chunk)
+            self.buf = b''
+            self.pos = 0
+            return b''.join(parts)
+        if self.pos >= len(self.buf):
+            self.buf = self.next_chunk()
+            self.pos = 0
+        ret = self.buf[self.pos:self.pos + size]
+        self.pos += len(ret)
+        return ret
+
+    def peek(self, size=1):
+        while len(self.buf) - self.pos < size:
+            chunk = self.next_chunk()
+            if not chunk:
+                break
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+        return self.buf[self.pos:]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+async def read_async(stream, chunk_size=ASYNC_CHUNK_SIZE):
+    if hasattr(stream, 'read'):
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        async for chunk in stream:
+            yield chunk
+
+async def extract_async(stream, sink, subdirs=False, jobs=1,
+                        chunk_size=ASYNC_CHUNK_SIZE,
+                        queue_size=ASYNC_QUEUE_SIZE, **kwargs):
+    loop = asyncio.get_running_loop()
+    extractor = Extractor(sink, subdirs, jobs=jobs, **kwargs)
+    chunks = asyncio.Queue(queue_size)
+    results = asyncio.Queue()
+    slots = Semaphore(queue_size)
+    cancelled = Event()
+    errors = []
+
+    async def feed():
+        try:
+            async for chunk in read_async(stream, chunk_size):
+                await chunks.put(chunk)
+            await chunks.put(None)
+        except Exception as err:
+            errors.append(err)
+            cancelled.set()
+
+    def run():
+        try:
+            reader = AsyncReader(chunks, loop, cancelled)
+            entries = extractor.extract(get_entries(reader, True))
+            try:
+                for result in entries:
+                    while not slots.acquire(timeout=ASYNC_POLL_INTERVAL):
+                        if cancelled.is_set():
+                            raise CancelledError()
+                    loop.call_soon_threadsafe(results.put_nowait, result)
+            finally:
+                entries.close()
+        finally:
+            loop.call_soon_threadsafe(results.put_nowait, None)
+
+    feeder = asyncio.ensure_future(feed())
+    worker = loop.run_in_executor(None, run)
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            slots.release()
+            yield result
+        if errors:
+            raise errors[0]
+        await worker
+    finally:
+        cancelled.set()
+        feeder.cancel()
+        await asyncio.wait([worker])
+        if not worker.cancelled():
+            worker.exception()
+
+
+def get_out_name(fname):
+    if fname == STDIN:
+        return 'stdin.d'
+    return os.path.basename(fname) + '.d'
+
+def expand_files(patterns):
+    ret = []
+    for pattern in patterns:
+        files = None
+        if glob.has_magic(pattern):
+            files = sorted(glob.glob(pattern))
+        if files:
+            ret.extend(files)
+        else:
+            ret.append(pattern)
+    return ret
+
+def get_entry_filter(args):
+    if (args.url is None and not args.host and not args.mime
+            and args.status is None
+            and args.min_size is None and args.max_size is None):
+        return None
+    return EntryFilter(args.url, args.host, args.mime, args.status,
+                       args.min_size, args.max_size)
+
+def extract_file(fname, outdir, args, manifest=None):
+    if args.index:
+        try:
+            count_ = make_index(fname)
+        except (ValueError, IOError) as err:
+            print('%s: %s' % (fname, err), file=sys.stderr)
+            return 1
+        if args.verbose:
+            print('%s: %d entries' % (get_index_path(fname), count_))
+        return 0
+
+    stats = None
+    if args.stats is not None and not args.list:
+        stats = Stats()
+
+    entry_filter = get_entry_filter(args)
+    rows = None
+    if (entry_filter is not None or args.list) and args.follow is None:
+        rows = read_index(fname)
+
+    try:
+        if fname == STDIN:
+            fp = sys.stdin
+        else:
+            fp = open(fname, 'rb')
+        try:
+            database = fp is not sys.stdin and is_database(fp)
+            if database:
+                if args.follow is not None:
+                    raise ValueError('Can not follow database input')
+                if (outdir is not None and os.path.exists(outdir)
+                        and os.path.samefile(fname, outdir)):
+                    raise ValueError('Can not extract database into itself')
+                rows = None
+            iterative = args.iterative
+            if args.follow is None and not args.list:
+                iterative = get_iterative(fp, iterative, args.max_memory)
+            if args.list:
+                if args.follow is not None:
+                    entries = follow_entries(fp, args.follow, args.strict)
+                    if entry_filter is not None:
+                        entries = filter(entry_filter.match, entries)
+                    list_entries(entries, batch_size=1)
+                    return 0
+                if database:
+                    entries = read_database(fname, bodies=False)
+                elif rows is not None:
+                    entries = (index_entry(row) for row in rows)
+                else:
+                    entries = get_metadata(fp)
+                if entry_filter is not None:
+                    entries = filter(entry_filter.match, entries)
+                list_entries(entries)
+                return 0
+            if args.split > 1 and outdir is not None:
+                if args.follow is not None:
+                    raise ValueError('Can not split followed input')
+                if args.resume:
+                    raise ValueError('Can not resume split extraction')
+                if get_archive_format(outdir) is not None:
+                    raise ValueError('Can not split into an archive')
+                if database:
+                    raise ValueError('Can not split database input')
+                extract_split(fp, outdir, args.split,
+                              args.directories, args.verbose, args.strict,
+                              jobs=args.jobs, dedupe=args.dedupe,
+                              entry_filter=entry_filter, stats=stats,
+                              manifest=manifest, cache=args.cache,
+                              cache_size=args.cache_size, shard=args.shard)
+                return 0
+            layout = None
+            plan = args.plan
+            replay = False
+            if (args.directories and not plan and outdir is not None
+                    and get_archive_format(outdir) is not None):
+                plan = replay = True
+            if plan and args.follow is not None:
+                raise ValueError('Can not plan layout of followed input')
+            if plan and outdir is not None:
+                if stats is not None:
+                    start = perf_counter()
+                ignore = ()
+                if args.resume:
+                    journal = Journal(os.path.join(outdir, JOURNAL_NAME))
+                    journal.load()
+                    ignore = journal.paths()
+                naming = None
+                if args.shard is not None:
+                    naming = ShardIndex(outdir, *args.shard).get_path
+                if database and replay:
+                    layout = replay_layout(
+                        read_database(fname, entry_filter, False),
+                        outdir, args.directories, naming
+                    )
+                elif database:
+                    layout = plan_layout(
+                        read_database(fname, entry_filter, False),
+                        outdir, args.directories, ignore, naming
+                    )
+                else:
+                    layout = read_layout(fp, outdir, args.directories,
+                                         entry_filter, ignore, naming, replay)
+                if stats is not None:
+                    stats.add_time('name', perf_counter() - start)
+            indexed = True
+            if args.follow is not None:
+                entries = enumerate_entries(
+                    follow_entries(fp, args.follow, args.strict),
+                    entry_filter
+                )
+            elif database:
+                entries = read_database(fname, entry_filter, indexed=True)
+            elif rows is not None:
+                entries = get_indexed_entries(fp, rows, entry_filter)
+            elif entry_filter is not None:
+                entries = select_entries(fp, entry_filter, iterative)
+            elif stats is not None:
+                start = perf_counter()
+                entries = get_entries(fp, iterative)
+                stats.add_time('parse', perf_counter() - start)
+                indexed = False
+            else:
+                entries = get_entries(fp, iterative)
+                indexed = False
+            extract(entries, outdir,
+                    args.directories, args.verbose, args.strict,
+                    jobs=args.jobs, dedupe=args.dedupe, stats=stats,
+                    layout=layout, resume=args.resume, manifest=manifest,
+                    cache=args.cache, cache_size=args.cache_size,
+                    shard=args.shard, indexed=indexed)
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+    except (ValueError, IOError) as err:
+        if args.strict and not args.resume and outdir is not None:
+            if get_archive_format(outdir) is not None:
+                try:
+                    os.remove(outdir)
+                except OSError:
+                    pass
             else:
-                print(msg, file=sys.stderr)
+                shutil.rmtree(outdir, ignore_errors=True)
+        print(err, file=sys.stderr)
+        return 1
+    finally:
+        if stats is not None:
+            print_stats(stats, fname, args.stats)
+    return 0
+
+def print_stats(stats, fname, fmt):
+    stats.stop()
+    if fname != STDIN:
+        try:
+            stats.set_input_size(os.path.getsize(fname))
+        except OSError:
+            pass
+    if fmt == 'json':
+        data = stats.to_dict()
+        data['file'] = fname
+        print(json.dumps(data), file=sys.stderr)
+    else:
+        print(stats.format(), file=sys.stderr)
+
+def extract_file_buffered(fname, outdir, args):
+    out = StringIO()
+    err = StringIO()
+    records = StringIO()
+    manifest = None
+    if args.manifest is not None:
+        manifest = Manifest(records, get_manifest_format(args.manifest),
+                            header=False)
+    with redirect_stdout(out), redirect_stderr(err):
+        ret = extract_file(fname, outdir, args, manifest)
+    return ret, out.getvalue(), err.getvalue(), records.getvalue()
 
 
 def main(args=None):
     parser = ArgumentParser(args)
 
-    parser.add_argument('file', metavar='FILE', help='HAR file')
+    parser.add_argument('file', metavar='FILE', nargs='+',
+                        help='HAR file, glob pattern or - for standard input;'
+                        ' may be compressed with gzip, bzip2 or xz, or be'
+                        ' a database written with -o <name>.sqlite')
 
     parser.add_argument('-V', '--version',
                         action='version', version=NAME_VERSION)
@@ -224,9 +3021,41 @@ def main(args=None):
     parser.add_argument('-l', '--list', action='store_true',
                         help='list the contents of input file')
 
+    parser.add_argument('-I', '--index', action='store_true',
+                        help='write byte offset index to <filename>%s'
+                        % INDEX_EXT)
+
+    parser.add_argument('-u', '--url', metavar='REGEX',
+                        type=parse_regex, default=None,
+                        help='select entries with matching url')
+
+    parser.add_argument('--host', metavar='HOST', action='append',
+                        help='select entries from host (can be repeated)')
+
+    parser.add_argument('--mime', metavar='GLOB', action='append',
+                        help='select entries with matching mime type'
+                        ' (can be repeated)')
+
+    parser.add_argument('--status', metavar='RANGE',
+                        type=parse_status, default=None,
+                        help='select entries with response status in range'
+                        ' (e.g. 200,300-399,4xx)')
+
+    parser.add_argument('--min-size', metavar='SIZE',
+                        type=parse_size, default=None,
+                        help='select entries with content size >= SIZE')
+
+    parser.add_argument('--max-size', metavar='SIZE',
+                        type=parse_size, default=None,
+                        help='select entries with content size <= SIZE')
+
     parser.add_argument('-o', '--output',
                         metavar='DIRECTORY', default=None,
-                        help='set output directory (default: ./<filename>.d)')
+                        help='set output directory (default: ./<filename>.d)'
+                        ' or parent directory for multiple files;'
+                        ' write to an archive if DIRECTORY ends with .zip,'
+                        ' .tar, .tar.gz, .tar.bz2 or .tar.xz, or to an'
+                        ' SQLite database if it ends with .sqlite')
 
     parser.add_argument('-v', '--verbose',
                         dest='verbose',
@@ -248,6 +3077,17 @@ def main(args=None):
                         action='store_false',
                         help='do not use iterative json parser (default)')
 
+    parser.add_argument('-ai', '--auto-iterative',
+                        dest='iterative',
+                        action='store_const', const=AUTO,
+                        help='use iterative json parser if the input does'
+                        ' not fit in memory (default with --max-memory)')
+
+    parser.add_argument('--max-memory', metavar='SIZE',
+                        type=parse_size, default=None,
+                        help='memory budget for -ai (default: free memory;'
+                        ' split between processes)')
+
     parser.add_argument('-s', '--strict',
                         dest='strict',
                         action='store_true',
@@ -268,8 +3108,71 @@ def main(args=None):
                         action='store_false',
                         help='do not create url directories')
 
+    parser.add_argument('--shard', metavar='DEPTH[:WIDTH]',
+                        type=parse_shard, default=None,
+                        help='store files in DEPTH levels of directories'
+                        ' named by WIDTH hex digits of the url hash'
+                        ' (default width: %d) instead of url directories'
+                        ' and map names to paths in <output>/%s'
+                        % (SHARD_WIDTH, SHARDS_NAME))
+
+    parser.add_argument('-j', '--jobs',
+                        metavar='N', type=int, default=1,
+                        help='write extracted files using N threads'
+                        ' (default: 1)')
+
+    parser.add_argument('-p', '--processes',
+                        metavar='N', type=int, default=1,
+                        help='extract multiple files using N processes'
+                        ' (default: 1)')
+
+    parser.add_argument('-S', '--split',
+                        metavar='N', type=int, default=1,
+                        help='split the entries of an uncompressed input'
+                        ' file between N processes (default: 1)')
+
+    parser.add_argument('-D', '--dedupe', action='store_true',
+                        help='store identical files once and hardlink them')
+
+    parser.add_argument('-C', '--cache', metavar='DIRECTORY', default=None,
+                        help='link bodies extracted by previous runs from'
+                        ' cache DIRECTORY instead of decoding them again')
+
+    parser.add_argument('--cache-size', metavar='SIZE',
+                        type=parse_size, default=CACHE_SIZE,
+                        help='evict least recently used bodies from the'
+                        ' cache above SIZE (default: %s)'
+                        % format_size(CACHE_SIZE))
+
+    parser.add_argument('--plan', action='store_true',
+                        help='read the URLs first and lay out the output'
+                        ' tree up front, so no file is moved afterwards')
+
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='record finished entries in <output>/%s and'
+                        ' skip the ones a previous run finished'
+                        % JOURNAL_NAME)
+
+    parser.add_argument('-F', '--follow', metavar='FORMAT',
+                        nargs='?', const='ndjson', default=None,
+                        choices=FOLLOW_FORMATS,
+                        help='keep reading as the input grows and extract'
+                        ' entries as they arrive until end of stream or'
+                        ' interrupt (FORMAT: ndjson (default), one entry'
+                        ' per line, or har)')
+
+    parser.add_argument('-m', '--manifest', metavar='FILE', default=None,
+                        help='write one record per entry to FILE as JSON'
+                        ' lines, or as CSV if FILE ends with .csv')
+
+    parser.add_argument('--stats', metavar='FORMAT',
+                        nargs='?', const='text', default=None,
+                        choices=('text', 'json'),
+                        help='print per-phase timing to stderr'
+                        ' (FORMAT: text (default) or json)')
+
     parser.set_defaults(
-        iterative=False,
+        iterative=None,
         directories=True,
         strict=False,
         verbose=True
@@ -280,31 +3183,98 @@ def main(args=None):
     else:
         args = parser.parse_args()
 
-    if args.file is None:
+    if not args.file:
         return 1
 
-    if args.list:
-        outdir = None
+    files = expand_files(args.file)
+
+    if args.list or args.index:
+        outdirs = [None] * len(files)
     else:
+        if (len(files) > 1 and args.output
+                and get_archive_format(args.output) is not None):
+            print('"%s": archive output requires a single input file'
+                  % args.output, file=sys.stderr)
+            return 1
+        if (args.resume and args.output
+                and get_archive_format(args.output) is not None
+                and not os.path.isdir(args.output)):
+            print('"%s": archive output can not be resumed'
+                  % args.output, file=sys.stderr)
+            return 1
+        if len(files) > 1 and args.output and not os.path.exists(args.output):
+            os.makedirs(args.output)
         try:
-            outdir = get_out_dir(args.output,
-                                 os.path.basename(args.file) + '.d')
+            outdirs = [
+                get_out_dir(args.output, get_out_name(fname))
+                for fname in files
+            ]
+            if args.resume and len(files) == 1:
+                outdirs = [get_resume_dir(args.output, outdirs[0])]
         except ValueError as err:
             print(err, file=sys.stderr)
             return 1
 
+    errors = 0
+    archives = []
+    seen = {}
+    for fname, outdir in zip(files, outdirs):
+        if outdir is not None:
+            key = os.path.normpath(outdir)
+            if key in seen:
+                print('"%s": output directory "%s" is used by "%s"'
+                      % (fname, outdir, seen[key]), file=sys.stderr)
+                errors += 1
+                continue
+            seen[key] = fname
+        archives.append((fname, outdir))
+
+    header = len(files) > 1 and (args.verbose or args.list)
+
+    manifest_fp = None
+    manifest = None
+    if args.manifest is not None and not (args.list or args.index):
+        try:
+            manifest_fp = open(args.manifest, 'w', newline='')
+        except (OSError, IOError) as err:
+            print(err, file=sys.stderr)
+            return 1
+        manifest = Manifest(manifest_fp, get_manifest_format(args.manifest))
+
     try:
-        with open(args.file, 'rb') as fp:
-            entries = get_entries(fp, args.iterative)
-            extract(entries, outdir,
-                    args.directories, args.verbose, args.strict)
-    except (ValueError, IOError) as err:
-        if args.strict:
-            shutil.rmtree(outdir)
-        print(err, file=sys.stderr)
-        return 1
+        if (args.processes > 1 and len(archives) > 1
+                and STDIN not in files):
+            if args.max_memory is not None:
+                args.max_memory //= min(args.processes, len(archives))
+            with ProcessPoolExecutor(args.processes) as pool:
+                futures = [
+                    pool.submit(extract_file_buffered, fname, outdir, args)
+                    for fname, outdir in archives
+                ]
+                for (fname, _), future in zip(archives, futures):
+                    ret, out, err, records = future.result()
+                    if header:
+                        print('%s:' % fname)
+                    sys.stdout.write(out)
+                    sys.stdout.flush()
+                    sys.stderr.write(err)
+                    if manifest_fp is not None:
+                        manifest_fp.write(records)
+                    errors += ret
+        else:
+            for fname, outdir in archives:
+                if header:
+                    print('%s:' % fname)
+                errors += extract_file(fname, outdir, args, manifest)
+    finally:
+        if manifest_fp is not None:
+            manifest_fp.close()
 
-    return 0
+    if len(files) > 1:
+        print('%d archives, %d errors' % (len(files), errors),
+              file=sys.stderr)
+
+    return 1 if errors else 0
 
 
 if __name__ == '__main__':
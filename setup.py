@@ -25,7 +25,11 @@ setup(
         'Intended Audience :: End Users/Desktop',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: System :: Archiving',
         'Topic :: Utilities'
@@ -44,13 +48,14 @@ setup(
     test_suite='setup.tests',
     install_requires=['ijson'],
     extras_require={
+        'fast': ['orjson'],
         'dev': [
             'coverage',
             'twine>=1.8.1',
             'wheel'
         ]
     },
-    python_requires='>=3',
+    python_requires='>=3.7',
     include_package_data=True,
     zip_safe=False
 )
@@ -114,3 +114,10 @@ TEST_ARCHIVE_INVALID_LIST = '''<no method> <no url> -> 200 OK text/plain 4B
 <no method> <no url> -> <no status> <no status text> <no mime type> <invalid size>
 GET https://127.0.0.1/404 -> 404 Not Found text/plain 3B
 '''
+
+
+def make_entry(url, text, encoding=None):
+    content = {'text': text}
+    if encoding is not None:
+        content['encoding'] = encoding
+    return {'request': {'url': url}, 'response': {'content': content}}
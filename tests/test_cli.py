@@ -1,11 +1,33 @@
 # pylint:disable=too-many-arguments
 
 from unittest import TestCase
-from unittest.mock import patch, mock_open
-from io import StringIO
+from unittest.mock import patch, mock_open, call, ANY
+from tempfile import TemporaryDirectory
+from io import StringIO, BytesIO
 
+import os
+import json
+import gzip
+import shutil
+
+import har_extractor
 from har_extractor import main
 
+from data import TEST_ARCHIVE, TEST_ARCHIVE_LIST
+
+
+EXTRACT_ARGS = {
+    'jobs': 1,
+    'dedupe': False,
+    'layout': None,
+    'resume': False,
+    'manifest': None,
+    'cache': None,
+    'cache_size': 1024 ** 3,
+    'shard': None,
+    'stats': None,
+    'indexed': False
+}
 
 @patch('sys.stderr', new_callable=StringIO)
 @patch('shutil.rmtree')
@@ -30,9 +52,12 @@ class TestMain(TestCase):
         get_out_dir.assert_called_with(None, 'file.d')
         open_.assert_called_with('file', 'rb')
         get_entries.assert_called_with(handle, False)
-        extract.assert_called_with('entries', 'outdir', True, True, False)
+        extract.assert_called_with('entries', 'outdir', True, True, False,
+                                   **EXTRACT_ARGS)
 
-    def test_list(self, extract, get_entries,
+    @patch('har_extractor.list_entries')
+    @patch('har_extractor.get_metadata', return_value='metadata')
+    def test_list(self, get_metadata, list_entries, extract, get_entries,
                   get_out_dir, open_, rmtree, stderr):
         handle = open_()
         self.assertEqual(main(['-l', 'file']), 0)
@@ -41,14 +66,16 @@ class TestMain(TestCase):
         self.assertEqual(rmtree.call_count, 0)
         self.assertEqual(get_out_dir.call_count, 0)
         open_.assert_called_with('file', 'rb')
-        get_entries.assert_called_with(handle, False)
-        extract.assert_called_with('entries', None, True, True, False)
+        get_metadata.assert_called_with(handle)
+        list_entries.assert_called_with('metadata')
+        self.assertEqual(get_entries.call_count, 0)
+        self.assertEqual(extract.call_count, 0)
 
     def test_args(self, extract, get_entries,
                   get_out_dir, open_, rmtree, stderr):
         handle = open_()
         self.assertEqual(
-            main(['-v', '-i', '-d', '-s', '-o', 'dir', 'file']),
+            main(['-v', '-i', '-d', '-s', '-D', '-o', 'dir', 'file']),
             0
         )
         stderr.seek(0)
@@ -57,10 +84,11 @@ class TestMain(TestCase):
         get_out_dir.assert_called_with('dir', 'file.d')
         open_.assert_called_with('file', 'rb')
         get_entries.assert_called_with(handle, True)
-        extract.assert_called_with('entries', 'outdir', True, True, True)
+        extract.assert_called_with('entries', 'outdir', True, True, True,
+                                   **dict(EXTRACT_ARGS, dedupe=True))
 
         self.assertEqual(
-            main(['-nv', '-ni', '-nd', '-ns', '-o', 'dir', 'file']),
+            main(['-nv', '-ni', '-nd', '-ns', '-j', '4', '-o', 'dir', 'file']),
             0
         )
         stderr.seek(0)
@@ -69,7 +97,8 @@ class TestMain(TestCase):
         get_out_dir.assert_called_with('dir', 'file.d')
         open_.assert_called_with('file', 'rb')
         get_entries.assert_called_with(handle, False)
-        extract.assert_called_with('entries', 'outdir', False, False, False)
+        extract.assert_called_with('entries', 'outdir', False, False, False,
+                                   **dict(EXTRACT_ARGS, jobs=4))
 
     def test_getdir_error(self, extract, get_entries,
                           get_out_dir, open_, rmtree, stderr):
@@ -94,7 +123,8 @@ class TestMain(TestCase):
         get_out_dir.assert_called_with(None, 'file.d')
         open_.assert_called_with('file', 'rb')
         get_entries.assert_called_with(handle, False)
-        extract.assert_called_with('entries', 'outdir', True, True, False)
+        extract.assert_called_with('entries', 'outdir', True, True, False,
+                                   **EXTRACT_ARGS)
 
     def test_extract_error_strict(self, extract, get_entries,
                                   get_out_dir, open_, rmtree, stderr):
@@ -103,8 +133,388 @@ class TestMain(TestCase):
         self.assertEqual(main(['-s', 'file']), 1)
         stderr.seek(0)
         self.assertEqual(stderr.read(), 'io error\n')
-        rmtree.assert_called_with('outdir')
+        rmtree.assert_called_with('outdir', ignore_errors=True)
         get_out_dir.assert_called_with(None, 'file.d')
         open_.assert_called_with('file', 'rb')
         get_entries.assert_called_with(handle, False)
-        extract.assert_called_with('entries', 'outdir', True, True, True)
+        extract.assert_called_with('entries', 'outdir', True, True, True,
+                                   **EXTRACT_ARGS)
+
+
+@patch('sys.stderr', new_callable=StringIO)
+@patch('har_extractor.get_out_dir', side_effect=lambda _, name: name)
+@patch('har_extractor.extract_file', return_value=0)
+class TestMainBatch(TestCase):
+    @patch('glob.glob', return_value=['b.har', 'a.har'])
+    def test_glob(self, glob_, extract_file, get_out_dir, stderr):
+        self.assertEqual(main(['-nv', '*.har', 'c.har']), 0)
+        glob_.assert_called_with('*.har')
+        extract_file.assert_has_calls([
+            call('a.har', 'a.har.d', ANY, None),
+            call('b.har', 'b.har.d', ANY, None),
+            call('c.har', 'c.har.d', ANY, None)
+        ])
+        self.assertEqual(extract_file.call_count, 3)
+        stderr.seek(0)
+        self.assertEqual(stderr.read(), '3 archives, 0 errors\n')
+
+    @patch('glob.glob', return_value=[])
+    def test_glob_no_match(self, _, extract_file, get_out_dir, stderr):
+        extract_file.return_value = 1
+        self.assertEqual(main(['*.har']), 1)
+        extract_file.assert_called_with('*.har', '*.har.d', ANY, None)
+
+    def test_errors(self, extract_file, get_out_dir, stderr):
+        extract_file.side_effect = [0, 1]
+        self.assertEqual(main(['-nv', 'a.har', 'dir/a.har', 'b.har']), 1)
+        self.assertEqual(extract_file.call_count, 2)
+        stderr.seek(0)
+        lines = stderr.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[-1], '3 archives, 2 errors')
+
+    def test_archive_error(self, extract_file, get_out_dir, stderr):
+        self.assertEqual(main(['-o', 'out.zip', 'a.har', 'b.har']), 1)
+        self.assertEqual(extract_file.call_count, 0)
+        self.assertNotEqual(stderr.getvalue(), '')
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_header(self, stdout, extract_file, get_out_dir, stderr):
+        self.assertEqual(main(['-l', 'a.har', 'b.har']), 0)
+        self.assertEqual(get_out_dir.call_count, 0)
+        extract_file.assert_has_calls([
+            call('a.har', None, ANY, None),
+            call('b.har', None, ANY, None)
+        ])
+        stdout.seek(0)
+        self.assertEqual(stdout.read(), 'a.har:\nb.har:\n')
+
+
+class TestMainProcesses(TestCase):
+    def test_processes(self):
+        with TemporaryDirectory() as tmp:
+            files = []
+            for i in range(3):
+                fname = os.path.join(tmp, '%d.har' % i)
+                with open(fname, 'w') as fp:
+                    json.dump(TEST_ARCHIVE, fp)
+                files.append(fname)
+            out = os.path.join(tmp, 'out')
+            with patch('sys.stdout', new_callable=StringIO), \
+                 patch('sys.stderr', new_callable=StringIO) as stderr:
+                ret = main(['-p', '2', '-o', out,
+                            os.path.join(tmp, '*.har')])
+            self.assertEqual(ret, 0)
+            self.assertEqual(stderr.getvalue(), '3 archives, 0 errors\n')
+            for i in range(3):
+                with open(os.path.join(out, '%d.har.d' % i,
+                                       '127.0.0.1', 'dir')) as fp:
+                    self.assertEqual(fp.read(), 'test2\n')
+
+    def test_manifest(self):
+        with TemporaryDirectory() as tmp:
+            for i in range(2):
+                with open(os.path.join(tmp, '%d.har' % i), 'w') as fp:
+                    json.dump(TEST_ARCHIVE, fp)
+            manifest = os.path.join(tmp, 'manifest.csv')
+            for processes in ('1', '2'):
+                out = os.path.join(tmp, 'out' + processes)
+                with patch('sys.stdout', new_callable=StringIO), \
+                     patch('sys.stderr', new_callable=StringIO):
+                    ret = main(['-p', processes, '-m', manifest, '-o', out,
+                                os.path.join(tmp, '*.har')])
+                self.assertEqual(ret, 0)
+                with open(manifest) as fp:
+                    lines = fp.read().splitlines()
+                self.assertEqual(len(lines), 7)
+                self.assertTrue(lines[0].startswith('index,'))
+                self.assertIn(os.path.join(out, '1.har.d', '127.0.0.1', 'dir'),
+                              lines[5])
+
+
+class TestMainIndex(TestCase):
+    def test_index(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(main(['-I', fname]), 0)
+            self.assertEqual(stdout.getvalue(),
+                             '%s.idx: 3 entries\n' % fname)
+
+            with patch('sys.stdout', new_callable=StringIO) as stdout, \
+                 patch('har_extractor.get_entries') as get_entries:
+                self.assertEqual(main(['-l', fname]), 0)
+                self.assertEqual(main(['-l', '-u', '/dir/$', fname]), 0)
+                self.assertEqual(get_entries.call_count, 0)
+            self.assertEqual(stdout.getvalue(),
+                             TEST_ARCHIVE_LIST
+                             + TEST_ARCHIVE_LIST.splitlines(True)[1])
+
+            out = os.path.join(tmp, 'out')
+            with patch('sys.stdout', new_callable=StringIO):
+                self.assertEqual(main(['-u', '/dir/', '-o', out, fname]), 0)
+            self.assertEqual(os.listdir(os.path.join(out, '127.0.0.1')),
+                             ['dir'])
+
+    def test_filter(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            for args in (['-i'], ['-ni']):
+                with patch('sys.stdout', new_callable=StringIO) as stdout:
+                    self.assertEqual(main(args + [
+                        '--host', '127.0.0.1', '--mime', 'text/*',
+                        '--status', '2xx', '--min-size', '5',
+                        '-o', out, fname
+                    ]), 0)
+                self.assertEqual(stdout.getvalue().splitlines()[0],
+                                 TEST_ARCHIVE_LIST.splitlines()[1])
+                self.assertEqual(
+                    os.listdir(os.path.join(out, '127.0.0.1')), ['dir']
+                )
+                shutil.rmtree(out)
+
+    def test_filter_resume(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            for args in (['-i'], ['-ni'], ['-I']):
+                if args == ['-I']:
+                    with patch('sys.stdout', new_callable=StringIO):
+                        self.assertEqual(main(['-I', fname]), 0)
+                    args = []
+                self.assertEqual(main(args + [
+                    '-nv', '-r', '-u', '/dir/', '-o', out, fname
+                ]), 0)
+                with open(os.path.join(out, '.journal')) as fp:
+                    records = [json.loads(line) for line in fp]
+                self.assertEqual(
+                    [record['index'] for record in records
+                     if 'sha256' in record],
+                    [1]
+                )
+                shutil.rmtree(out)
+
+    def test_filter_manifest(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            manifest = os.path.join(tmp, 'manifest.csv')
+            for args in ([], ['-S', '2']):
+                self.assertEqual(main(args + [
+                    '-nv', '-u', '/dir/', '-m', manifest, '-o', out, fname
+                ]), 0)
+                with open(manifest) as fp:
+                    lines = fp.read().splitlines()
+                self.assertEqual(len(lines), 2)
+                self.assertTrue(lines[1].startswith('1,'))
+                shutil.rmtree(out)
+
+    def test_sqlite(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            db = os.path.join(tmp, 'test.sqlite')
+            self.assertEqual(main(['-nv', '-o', db, fname]), 0)
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(main(['-l', db]), 0)
+            self.assertEqual(stdout.getvalue(), TEST_ARCHIVE_LIST)
+            out = os.path.join(tmp, 'out')
+            self.assertEqual(main(['-nv', '--plan', '--mime', 'text/*',
+                                   '-o', out, db]), 0)
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(out, '127.0.0.1'))),
+                ['dir', 'index.html']
+            )
+
+    def test_shard(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            for args in ([], ['--plan'], ['-S', '2']):
+                out = os.path.join(tmp, 'out')
+                self.assertEqual(main(['-nv', '--shard', '2:1', '-o', out,
+                                       fname] + args), 0)
+                with open(os.path.join(out, '.shards')) as fp:
+                    shards = [json.loads(line) for line in fp]
+                self.assertEqual([item['name'] for item in shards],
+                                 ['index.html', 'dir'])
+                for item in shards:
+                    path = item['path'].split(os.sep)
+                    self.assertEqual([len(part) for part in path[:-1]],
+                                     [1, 1])
+                    self.assertEqual(path[-1], item['name'])
+                    self.assertTrue(os.path.isfile(os.path.join(
+                        out, item['path']
+                    )))
+                shutil.rmtree(out)
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_split(self, stderr):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(main(['-S', '2', '-o', out, fname]), 0)
+            self.assertEqual(stdout.getvalue().count('---->'), 3)
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(out, '127.0.0.1'))),
+                ['dir', 'index.html']
+            )
+            self.assertEqual(main(['-nv', '-S', '2', '-r', '-o', out, fname]),
+                             1)
+            self.assertEqual(stderr.getvalue(),
+                             'Can not resume split extraction\n')
+
+    @patch('har_extractor.get_entries', wraps=har_extractor.get_entries)
+    def test_max_memory(self, get_entries):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har.gz')
+            with gzip.open(fname, 'wt') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            for args, iterative in ((['--max-memory', '1'], True),
+                                    (['--max-memory', '1M'], False),
+                                    (['-ni', '--max-memory', '1'], False),
+                                    (['-ai'], False)):
+                self.assertEqual(main(['-nv', '-o', out, fname] + args), 0)
+                get_entries.assert_called_with(ANY, iterative)
+                self.assertEqual(
+                    sorted(os.listdir(os.path.join(out, '127.0.0.1'))),
+                    ['dir', 'index.html']
+                )
+                shutil.rmtree(out)
+
+    @patch('sys.stderr', new_callable=StringIO)
+    @patch('sys.exit', side_effect=SystemExit)
+    def test_filter_error(self, exit_, _):
+        for args in (['-u', '('], ['--status', 'x'], ['--min-size', 'x']):
+            with self.assertRaises(SystemExit):
+                main(args + ['file'])
+            exit_.assert_called_with(2)
+
+
+class TestMainInput(TestCase):
+    def test_compressed(self):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har.gz')
+            with open(fname, 'wb') as fp:
+                fp.write(gzip.compress(data))
+            out = os.path.join(tmp, 'out')
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(main(['-l', fname]), 0)
+                self.assertEqual(main(['-i', '-o', out, fname]), 0)
+            self.assertTrue(stdout.getvalue().startswith(TEST_ARCHIVE_LIST))
+            with open(os.path.join(out, '127.0.0.1', 'dir')) as fp:
+                self.assertEqual(fp.read(), 'test2\n')
+            with patch('sys.stderr', new_callable=StringIO):
+                self.assertEqual(main(['-I', fname]), 1)
+
+    def test_stats(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(TEST_ARCHIVE, fp)
+            out = os.path.join(tmp, 'out')
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                self.assertEqual(
+                    main(['-nv', '--stats', '-o', out, fname]), 0
+                )
+                self.assertTrue(stderr.getvalue().startswith('phase '))
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                self.assertEqual(
+                    main(['-nv', '--stats', 'json', '-o', out, fname]), 0
+                )
+                data = json.loads(stderr.getvalue())
+            self.assertEqual(data['file'], fname)
+            self.assertEqual(data['entries'], 3)
+            self.assertEqual(data['phases']['parse']['bytes_in'],
+                             os.path.getsize(fname))
+
+    @patch('time.sleep', side_effect=KeyboardInterrupt)
+    @patch('sys.stdin')
+    def test_follow(self, stdin, _):
+        data = ''.join(json.dumps(entry) + '\n'
+                       for entry in TEST_ARCHIVE['log']['entries'])
+        with TemporaryDirectory() as tmp:
+            stdin.buffer = BytesIO(data.encode('utf-8'))
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(main(['-F', '-l', '-']), 0)
+            self.assertEqual(stdout.getvalue(), TEST_ARCHIVE_LIST)
+            stdin.buffer = BytesIO(data.encode('utf-8'))
+            with patch('sys.stdout', new_callable=StringIO):
+                self.assertEqual(main(['-F', '-o', tmp, '-']), 0)
+            with open(os.path.join(tmp, 'stdin.d', '127.0.0.1', 'dir')) as fp:
+                self.assertEqual(fp.read(), 'test2\n')
+
+    @patch('sys.stdin')
+    def test_stdin(self, stdin):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        stdin.buffer = BytesIO(data)
+        with TemporaryDirectory() as tmp:
+            with patch('sys.stdout', new_callable=StringIO):
+                self.assertEqual(main(['-o', tmp, '-']), 0)
+            with open(os.path.join(tmp, 'stdin.d', '127.0.0.1', 'dir')) as fp:
+                self.assertEqual(fp.read(), 'test2\n')
+
+
+class TestMainPlan(TestCase):
+    ARCHIVE = {'log': {'entries': [
+        {
+            'request': {'url': url},
+            'response': {'content': {'text': text}}
+        }
+        for url, text in (
+            ('http://h/a', 'a'),
+            ('http://h/a/b', 'b'),
+            ('http://h/a', 'a1'),
+            ('http://h/a/b/c', 'c')
+        )
+    ]}}
+
+    @patch('shutil.move')
+    def test_plan(self, move):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(self.ARCHIVE, fp)
+            for args in ([], ['-i'], ['-j', '2']):
+                out = os.path.join(tmp, 'out')
+                self.assertEqual(
+                    main(['-nv', '--plan', '-o', out, fname] + args), 0
+                )
+                files = {}
+                for path, _, names in os.walk(out):
+                    for name in names:
+                        with open(os.path.join(path, name)) as fp:
+                            files[os.path.relpath(fp.name, out)] = fp.read()
+                self.assertEqual(files, {
+                    os.path.join('h', 'a', 'index.html'): 'a',
+                    os.path.join('h', 'a', 'index.1.html'): 'a1',
+                    os.path.join('h', 'a', 'b', 'index.html'): 'b',
+                    os.path.join('h', 'a', 'b', 'c'): 'c'
+                })
+                shutil.rmtree(out)
+        self.assertEqual(move.call_count, 0)
+
+    @patch('sys.stdin')
+    def test_plan_stdin(self, stdin):
+        stdin.buffer = BytesIO(json.dumps(self.ARCHIVE).encode('utf-8'))
+        with TemporaryDirectory() as tmp:
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                self.assertEqual(main(['--plan', '-o', tmp, '-']), 1)
+            self.assertIn('standard input', stderr.getvalue())
@@ -1,17 +1,32 @@
 # pylint:disable=too-many-arguments
 
 from unittest import TestCase
-from unittest.mock import patch, call
-from io import StringIO
+from unittest.mock import patch, call, ANY
+from tempfile import TemporaryDirectory
+from io import StringIO, BytesIO
+from hashlib import sha256
 
 import os
+import gzip
+import time
+import asyncio
+import json
+import tarfile
+import zipfile
+import shutil
+import sqlite3
 
-from har_extractor import extract
+from har_extractor import (
+    extract, Stats, Manifest, Extractor, EntryFilter, Sink, FileSink,
+    MemorySink, extract_async, extract_split, get_chunks,
+    get_entries, read_database, format_entry, Journal, ContentStore,
+    STORE_DIR, JOURNAL_NAME
+)
 
 from data import (
     TEST_ARCHIVE, TEST_ARCHIVE_LIST, TEST_ARCHIVE_CONTENTS,
     TEST_ARCHIVE_VERBOSE, TEST_ARCHIVE_INVALID_VERBOSE,
-    TEST_ARCHIVE_INVALID, TEST_ARCHIVE_INVALID_LIST
+    TEST_ARCHIVE_INVALID, TEST_ARCHIVE_INVALID_LIST, make_entry
 )
 
 @patch('os.path.exists', return_value=False)
@@ -49,7 +64,7 @@ class TestDoExtract(TestCase):
             for content, fname in TEST_ARCHIVE_CONTENTS
         ])
         make_entry_dirs.assert_has_calls([
-            call('dir/', os.path.join('dir/127.0.0.1', fname))
+            call('dir/', os.path.join('dir/127.0.0.1', fname), ANY)
             for _, fname in TEST_ARCHIVE_CONTENTS
         ])
         self.assertEqual(make_entry_dirs.call_count, 2)
@@ -118,6 +133,71 @@ class TestDoExtract(TestCase):
         with self.assertRaises(IOError):
             extract(TEST_ARCHIVE['log']['entries'], 'dir/', verbose=True)
 
+    def test_extract_jobs(self, stdout, stderr,
+                          write, make_entry_dirs, makedirs, _):
+        extract(TEST_ARCHIVE['log']['entries'], 'dir/', subdirs=True,
+                verbose=True, jobs=4)
+        stdout.seek(0)
+        stderr.seek(0)
+        write.assert_has_calls([
+            call(content, os.path.join('dir/127.0.0.1', fname))
+            for content, fname in TEST_ARCHIVE_CONTENTS
+        ], any_order=True)
+        self.assertEqual(write.call_count, 2)
+        make_entry_dirs.assert_has_calls([
+            call('dir/', os.path.join('dir/127.0.0.1', fname), ANY)
+            for _, fname in TEST_ARCHIVE_CONTENTS
+        ])
+        self.assertEqual(stdout.read(), TEST_ARCHIVE_VERBOSE.replace(
+            '> dir/', '> dir/127.0.0.1/'
+        ))
+        self.assertEqual(stderr.read(), '')
+
+    def test_extract_jobs_ioerror(self, stdout, stderr,
+                                  write, make_entry_dirs, makedirs, _):
+        write.side_effect = IOError
+
+        extract(TEST_ARCHIVE['log']['entries'],
+                'dir/', verbose=True, exit_on_error=False, jobs=2)
+        stdout.seek(0)
+        stderr.seek(0)
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(stdout.read(), TEST_ARCHIVE_VERBOSE)
+        self.assertEqual(len(stderr.read().splitlines()), 2)
+
+        with self.assertRaises(IOError):
+            extract(TEST_ARCHIVE['log']['entries'], 'dir/', jobs=2)
+
+    def test_extract_stats(self, stdout, stderr,
+                           write, make_entry_dirs, makedirs, _):
+        stats = Stats()
+        extract(TEST_ARCHIVE['log']['entries'], 'dir/', subdirs=True,
+                stats=stats)
+        data = stats.to_dict()
+        self.assertEqual(data['entries'], 3)
+        phases = data['phases']
+        self.assertEqual(phases['parse']['calls'], 3)
+        self.assertEqual(phases['decode']['calls'], 2)
+        self.assertEqual(phases['decode']['bytes_in'], 12)
+        self.assertEqual(phases['decode']['bytes_out'], 10)
+        self.assertEqual(phases['name']['calls'], 2)
+        self.assertEqual(phases['mkdir']['calls'], 2)
+        self.assertEqual(phases['write']['calls'], 2)
+        self.assertEqual(phases['write']['bytes_out'], 10)
+        self.assertEqual(write.call_count, 2)
+
+    @patch('har_extractor.BASE64_CHUNK_SIZE', new=4)
+    def test_extract_stats_stream(self, stdout, stderr,
+                                  write, make_entry_dirs, makedirs, _):
+        write.side_effect = lambda content, _: list(content)
+        stats = Stats()
+        extract(TEST_ARCHIVE['log']['entries'], 'dir/', jobs=2, stats=stats)
+        phases = stats.to_dict()['phases']
+        self.assertEqual(phases['decode']['calls'], 2)
+        self.assertEqual(phases['decode']['bytes_in'], 12)
+        self.assertEqual(phases['decode']['bytes_out'], 10)
+        self.assertEqual(phases['write']['bytes_out'], 10)
+
     def test_extract_list(self, stdout, stderr,
                           write, make_entry_dirs, makedirs, _):
         extract(TEST_ARCHIVE['log']['entries'], None)
@@ -140,3 +220,656 @@ class TestDoExtract(TestCase):
         self.assertEqual(write.call_count, 0)
         self.assertEqual(make_entry_dirs.call_count, 0)
         #extract(TEST_ARCHIVE_INVALID['log']['entries'], None, False, False)
+
+
+class JobsTestMixin(object):
+    def test_sequential(self):
+        self.check(1)
+
+    def test_jobs(self):
+        self.check(3)
+
+
+class TestExtractDedupe(JobsTestMixin, TestCase):
+    def check(self, jobs):
+        entries = [
+            make_entry('http://a/x.js', 'dGVzdDIK', 'base64'),
+            make_entry('http://b/y.js', 'dGVzdDIK', 'base64'),
+            make_entry('http://a/x.js', 'dGVzdDIK', 'base64'),
+            make_entry('http://a/z.txt', 'test')
+        ]
+        with TemporaryDirectory() as tmp, \
+             patch('sys.stdout', new_callable=StringIO) as stdout:
+            extract(entries, tmp, subdirs=True, verbose=True,
+                    jobs=jobs, dedupe=True)
+            paths = [
+                os.path.join(tmp, 'a', 'x.js'),
+                os.path.join(tmp, 'b', 'y.js'),
+                os.path.join(tmp, 'a', 'x.1.js')
+            ]
+            for path in paths:
+                with open(path, 'rb') as fp:
+                    self.assertEqual(fp.read(), b'test2\n')
+            self.assertEqual(
+                len(set(os.stat(path).st_ino for path in paths)), 1
+            )
+            with open(os.path.join(tmp, 'a', 'z.txt')) as fp:
+                self.assertEqual(fp.read(), 'test')
+            objects = [
+                name
+                for _, _, files in os.walk(os.path.join(tmp, STORE_DIR))
+                for name in files
+            ]
+            self.assertEqual(len(objects), 2)
+            self.assertTrue(stdout.getvalue().endswith(
+                '2 objects, 2 duplicates, 12B saved, 2 inodes saved\n'
+            ))
+
+    def test_dedupe_existing(self):
+        with TemporaryDirectory() as tmp:
+            store = ContentStore(os.path.join(tmp, STORE_DIR))
+            fname = os.path.join(tmp, 'x')
+            for text in ('test', 'test2', 'test2'):
+                store.save(text, fname)
+                with open(fname) as fp:
+                    self.assertEqual(fp.read(), text)
+            self.assertEqual(sorted(os.listdir(tmp)), [STORE_DIR, 'x'])
+
+
+class TestExtractResume(JobsTestMixin, TestCase):
+    ENTRIES = [
+        make_entry('http://a/x', 'dGVzdDIK', 'base64'),
+        make_entry('http://a/x', 'test'),
+        make_entry('http://a/y', ''),
+        make_entry('http://a/x/z', 'test3')
+    ]
+
+    def files(self, root):
+        ret = {}
+        for path, _, names in os.walk(root):
+            for name in names:
+                with open(os.path.join(path, name), 'rb') as fp:
+                    ret[os.path.relpath(fp.name, root)] = fp.read()
+        del ret[JOURNAL_NAME]
+        return ret
+
+    def check(self, jobs):
+        with TemporaryDirectory() as tmp, \
+             patch('sys.stdout', new_callable=StringIO):
+            extract(self.ENTRIES, tmp, subdirs=True, jobs=jobs, resume=True)
+            files = self.files(tmp)
+            self.assertEqual(len(files), 3)
+            with open(os.path.join(tmp, JOURNAL_NAME)) as fp:
+                records = [json.loads(line) for line in fp]
+            self.assertEqual(
+                sorted(record['index'] for record in records
+                       if 'sha256' in record),
+                [0, 1, 3]
+            )
+            self.assertIn(
+                {'index': 3, 'path': os.path.join(tmp, 'a', 'x', 'z'),
+                 'sha256': sha256(b'test3').hexdigest()},
+                records
+            )
+
+            with patch('har_extractor.decode_content') as decode_content:
+                extract(self.ENTRIES, tmp, subdirs=True, jobs=jobs,
+                        resume=True)
+            self.assertEqual(decode_content.call_count, 0)
+            self.assertEqual(self.files(tmp), files)
+
+        with TemporaryDirectory() as tmp:
+            extract(self.ENTRIES[:1], tmp, subdirs=True, jobs=jobs,
+                    resume=True)
+            path = os.path.join(tmp, 'a', 'x.1')
+            with open(os.path.join(tmp, JOURNAL_NAME), 'a') as fp:
+                fp.write(json.dumps({'index': 1, 'path': path}))
+                fp.write('\n{"index": 1, "pa')
+            with open(path, 'w') as fp:
+                fp.write('partial')
+            extract(self.ENTRIES, tmp, subdirs=True, jobs=jobs, resume=True)
+            self.assertEqual(self.files(tmp), files)
+            with open(os.path.join(tmp, JOURNAL_NAME)) as fp:
+                records = [json.loads(line) for line in fp]
+            self.assertEqual(
+                len([record for record in records if 'move' not in record]),
+                7
+            )
+            journal = Journal(os.path.join(tmp, JOURNAL_NAME))
+            journal.load()
+            self.assertEqual(
+                sorted(path for path, _ in journal.done.values()),
+                [os.path.join(tmp, 'a', 'x', name)
+                 for name in ('index.1.html', 'index.html', 'z')]
+            )
+
+
+class TestExtractManifest(JobsTestMixin, TestCase):
+    def check(self, jobs):
+        entries = (TEST_ARCHIVE['log']['entries']
+                   + TEST_ARCHIVE_INVALID['log']['entries'])
+        out = StringIO()
+        with TemporaryDirectory() as tmp, \
+             patch('sys.stderr', new_callable=StringIO):
+            extract(entries, tmp, subdirs=True, exit_on_error=False,
+                    jobs=jobs, manifest=Manifest(out))
+            records = sorted(
+                (json.loads(line) for line in out.getvalue().splitlines()),
+                key=lambda record: record['index']
+            )
+            self.assertEqual([record['index'] for record in records],
+                             list(range(6)))
+            self.assertEqual(records[1], {
+                'index': 1,
+                'method': 'GET',
+                'url': 'https://127.0.0.1/dir/',
+                'status': 200,
+                'mime': 'text/plain',
+                'size': 8,
+                'written': 6,
+                'path': os.path.join(tmp, '127.0.0.1', 'dir'),
+                'sha256': sha256(b'test2\n').hexdigest(),
+                'error': None
+            })
+            self.assertEqual(records[0]['written'], 4)
+            self.assertIsNone(records[2]['path'])
+            self.assertIsNone(records[2]['error'])
+            self.assertTrue(records[3]['error'].startswith('Invalid entry'))
+            self.assertIsNone(records[3]['url'])
+            self.assertIsNone(records[4]['path'])
+            self.assertEqual(records[5]['path'],
+                             os.path.join(tmp, '127.0.0.1', '404'))
+
+    def test_manifest_csv(self):
+        out = StringIO()
+        with TemporaryDirectory() as tmp:
+            extract(TEST_ARCHIVE['log']['entries'], tmp,
+                    manifest=Manifest(out, 'csv'))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0],
+                         'index,method,url,status,mime,size,written,path,'
+                         'sha256,error')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[3].startswith(
+            '2,GET,https://127.0.0.1/404,404,text/plain,0,,,,'
+        ))
+
+
+@patch('sys.stderr', new_callable=StringIO)
+@patch('sys.stdout', new_callable=StringIO)
+class TestExtractor(TestCase):
+    ENTRIES = (TEST_ARCHIVE['log']['entries']
+               + TEST_ARCHIVE_INVALID['log']['entries'])
+
+    def test_memory(self, stdout, stderr):
+        sink = MemorySink()
+        results = list(Extractor(sink, subdirs=True,
+                                 digests=True).extract(self.ENTRIES))
+        self.assertEqual([result.index for result in results],
+                         list(range(6)))
+        self.assertEqual([result.status for result in results],
+                         ['written', 'written', 'empty',
+                          'error', 'empty', 'written'])
+        self.assertEqual(sink.files, {
+            os.path.join('127.0.0.1', 'index.html'): b'test',
+            os.path.join('127.0.0.1', 'dir'): b'test2\n',
+            os.path.join('127.0.0.1', '404'): b'404'
+        })
+        self.assertEqual(results[1].path, os.path.join('127.0.0.1', 'dir'))
+        self.assertEqual(results[1].sha256, sha256(b'test2\n').hexdigest())
+        self.assertEqual(results[1].size, 6)
+        self.assertIsInstance(results[3].error, ValueError)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_naming_filter(self, stdout, stderr):
+        sink = MemorySink()
+        extractor = Extractor(
+            sink,
+            naming=lambda entry: entry['response']['content']['mimeType'],
+            entry_filter=EntryFilter(status='200')
+        )
+        results = list(extractor.extract(self.ENTRIES))
+        self.assertEqual([result.index for result in results], [0, 1, 3])
+        self.assertEqual(sorted(sink.files),
+                         ['text/plain', 'text/plain.1', 'text/plain.2'])
+        self.assertIsNone(results[0].sha256)
+
+    def test_custom_sink(self, stdout, stderr):
+        class FailingSink(Sink):
+            def write(self, content, fname):
+                if fname == 'dir':
+                    raise IOError('full')
+
+        results = list(Extractor(FailingSink()).extract(self.ENTRIES))
+        self.assertEqual(results[0].status, 'written')
+        self.assertEqual(results[1].status, 'error')
+        self.assertIsInstance(results[1].error, IOError)
+        self.assertEqual(results[1].path, 'dir')
+
+    def test_file_jobs(self, stdout, stderr):
+        with TemporaryDirectory() as tmp:
+            sink = FileSink(tmp)
+            results = list(Extractor(sink, subdirs=True, jobs=3)
+                           .extract(self.ENTRIES * 4))
+            self.assertEqual([result.index for result in results],
+                             list(range(24)))
+            self.assertEqual(
+                sum(result.status == 'written' for result in results), 12
+            )
+            self.assertEqual(len(os.listdir(os.path.join(tmp, '127.0.0.1'))),
+                             12)
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_file_jobs_siblings(self, stdout, stderr):
+        class SlowSink(FileSink):
+            def write(self, content, fname):
+                if fname.endswith('a.1'):
+                    time.sleep(0.1)
+                super().write(content, fname)
+
+        urls = ['a'] + ['f%d' % i for i in range(20)] + ['a.1', 'a/b']
+        entries = [make_entry('https://127.0.0.1/' + url, url)
+                   for url in urls]
+        for jobs in (1, 2):
+            with TemporaryDirectory() as tmp:
+                list(Extractor(SlowSink(tmp), subdirs=True, jobs=jobs)
+                     .extract(entries))
+                tree = read_tree(tmp)
+                self.assertEqual(len(tree), 23)
+                self.assertEqual({
+                    name: tree[name] for name in tree
+                    if not os.path.basename(name).startswith('f')
+                }, {
+                    os.path.join('127.0.0.1', 'a', 'index.html'): b'a',
+                    os.path.join('127.0.0.1', 'a', 'index.1.html'): b'a.1',
+                    os.path.join('127.0.0.1', 'a', 'b'): b'a/b'
+                })
+
+    def test_file_jobs_sibling_dirs(self, stdout, stderr):
+        class SlowSink(FileSink):
+            def write(self, content, fname):
+                if fname.endswith('b') and 'a.1' in fname:
+                    time.sleep(0.1)
+                super().write(content, fname)
+
+        urls = ['a'] + ['f%d' % i for i in range(20)] + ['a.1/b', 'a/b']
+        entries = [make_entry('https://127.0.0.1/' + url, url)
+                   for url in urls]
+        for jobs in (1, 2):
+            with TemporaryDirectory() as tmp:
+                results = list(
+                    Extractor(SlowSink(tmp), subdirs=True, jobs=jobs)
+                    .extract(entries)
+                )
+                self.assertEqual({result.status for result in results},
+                                 {'written'})
+                tree = read_tree(tmp)
+                self.assertEqual(len(tree), 23)
+                self.assertEqual({
+                    name: tree[name] for name in tree
+                    if not os.path.basename(name).startswith('f')
+                }, {
+                    os.path.join('127.0.0.1', 'a', 'index.html'): b'a',
+                    os.path.join('127.0.0.1', 'a', 'index.1.html', 'b'):
+                        b'a.1/b',
+                    os.path.join('127.0.0.1', 'a', 'b'): b'a/b'
+                })
+
+
+def read_tree(root):
+    ret = {}
+    for path, _, files in os.walk(root):
+        for name in files:
+            fname = os.path.join(path, name)
+            with open(fname, 'rb') as fp:
+                ret[os.path.relpath(fname, root)] = fp.read()
+    return ret
+
+
+@patch('sys.stdout', new_callable=StringIO)
+class TestExtractSqlite(TestCase):
+    def test_sqlite(self, stdout):
+        entries = TEST_ARCHIVE['log']['entries'] * 2
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.sqlite')
+            extract(entries, path, True, True, jobs=4)
+            self.assertTrue(stdout.getvalue().endswith(
+                '6 entries, 2 duplicates, 10B saved\n'
+            ))
+            db = sqlite3.connect(path)
+            self.assertEqual(
+                db.execute('SELECT host, status, mime, name FROM entries'
+                           ' WHERE sha256 IS NOT NULL ORDER BY id').fetchall(),
+                [('127.0.0.1', 200, 'text/plain', name)
+                 for name in ('127.0.0.1/index.html', '127.0.0.1/dir',
+                              '127.0.0.1/index.1.html', '127.0.0.1/dir.1')]
+            )
+            self.assertEqual(
+                db.execute('SELECT count(*) FROM bodies').fetchone(), (2,)
+            )
+            db.close()
+
+            self.assertEqual([format_entry(entry) for entry
+                              in read_database(path, bodies=False)],
+                             [format_entry(entry) for entry in entries])
+            out = os.path.join(tmp, 'out')
+            extract(read_database(path, EntryFilter(status='200')), out)
+            self.assertEqual(read_tree(out), {
+                'index.html': b'test', 'dir': b'test2\n',
+                'index.1.html': b'test', 'dir.1': b'test2\n'
+            })
+
+    def test_sqlite_iterative(self, stdout):
+        entry = dict(TEST_ARCHIVE['log']['entries'][0],
+                     time=12.5, timings={'wait': 10.25, 'receive': 2})
+        data = json.dumps({'log': {'entries': [entry]}}).encode('utf-8')
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.sqlite')
+            extract(get_entries(BytesIO(data), True), path)
+            db = sqlite3.connect(path)
+            row = db.execute('SELECT time, timings FROM entries').fetchone()
+            db.close()
+            self.assertEqual(row[0], 12.5)
+            self.assertEqual(json.loads(row[1]),
+                             {'wait': 10.25, 'receive': 2})
+
+
+@patch('sys.stdout', new_callable=StringIO)
+class TestExtractCache(TestCase):
+    def test_cache(self, stdout):
+        with TemporaryDirectory() as tmp:
+            cache = os.path.join(tmp, 'cache')
+            entries = TEST_ARCHIVE['log']['entries']
+            for i, jobs in enumerate((1, 1, 4)):
+                out = os.path.join(tmp, 'out%d' % i)
+                manifest = Manifest(StringIO())
+                extract(entries, out, verbose=True, jobs=jobs,
+                        manifest=manifest, cache=cache)
+                self.assertEqual(read_tree(out), {
+                    'index.html': b'test', 'dir': b'test2\n'
+                })
+                digests = [json.loads(line)['sha256'] for line
+                           in manifest.fp.getvalue().splitlines()]
+                self.assertEqual(digests[1], sha256(b'test2\n').hexdigest())
+            lines = stdout.getvalue().splitlines()
+            self.assertEqual(
+                [line for line in lines if line.startswith('cache: ')],
+                ['cache: 0 hits, 2 misses, 0B reused, 0 evicted',
+                 'cache: 2 hits, 0 misses, 10B reused, 0 evicted',
+                 'cache: 2 hits, 0 misses, 10B reused, 0 evicted']
+            )
+            self.assertEqual(len(read_tree(cache)), 2)
+
+    def test_evict(self, stdout):
+        with TemporaryDirectory() as tmp:
+            cache = os.path.join(tmp, 'cache')
+            extract(TEST_ARCHIVE['log']['entries'], os.path.join(tmp, 'out'),
+                    verbose=True, cache=cache, cache_size=6)
+            self.assertEqual(list(read_tree(cache).values()), [b'test2\n'])
+            self.assertTrue(stdout.getvalue().endswith(
+                'cache: 0 hits, 2 misses, 0B reused, 1 evicted\n'
+            ))
+            self.assertRaises(ValueError, extract, [],
+                              os.path.join(tmp, 'out.zip'), cache=cache)
+
+
+@patch('sys.stdout', new_callable=StringIO)
+class TestExtractSplit(TestCase):
+    URLS = ('a', 'a', 'a.1/x', 'a/b', 'a', 'a/b/c', 'b', '', 'a/b',
+            'c/d', 'c', 'c/d/e', 'c/d', 'c.1', 'c.2/f', 'c/g/h',
+            'e.1/b.2', 'e', 'e/index.html/a/', 'f', 'f/index.html')
+
+    def get_archive(self, tmp):
+        entries = [{
+            'request': {'url': 'http://host/' + url},
+            'response': {'content': {'text': '%d %s' % (i, url)}}
+        } for i, url in enumerate(self.URLS)]
+        entries.insert(3, {'request': {'url': 'http://host/a'},
+                           'response': {'content': {}}})
+        fname = os.path.join(tmp, 'test.har')
+        with open(fname, 'w') as fp:
+            json.dump({'log': {'entries': entries}}, fp, indent=1)
+        return fname
+
+    def test_get_chunks(self, _):
+        spans = [(0, 10), (10, 1), (11, 1), (12, 10), (22, 5)]
+        self.assertEqual(get_chunks(spans, 3), [(0, 1), (1, 4), (4, 5)])
+        self.assertEqual(get_chunks(spans, 1), [(0, 5)])
+        self.assertEqual(get_chunks([], 2), [])
+
+    def test_extract_split(self, stdout):
+        with TemporaryDirectory() as tmp:
+            fname = self.get_archive(tmp)
+            expected = os.path.join(tmp, 'expected')
+            with open(fname, 'rb') as fp:
+                extract(get_entries(fp, False), expected, True)
+            for subdirs in (True, False):
+                for processes in (1, 3):
+                    out = os.path.join(tmp, 'out')
+                    manifest = Manifest(StringIO())
+                    with open(fname, 'rb') as fp:
+                        extract_split(fp, out, processes, subdirs,
+                                      manifest=manifest)
+                    if subdirs:
+                        self.assertEqual(read_tree(out), read_tree(expected))
+                    records = [
+                        json.loads(line)
+                        for line in manifest.fp.getvalue().splitlines()
+                    ]
+                    self.assertEqual([record['index'] for record in records],
+                                     list(range(len(self.URLS) + 1)))
+                    self.assertIsNone(records[3]['path'])
+                    self.assertTrue(all(os.path.exists(record['path'])
+                                        for record in records
+                                        if record['path'] is not None))
+                    self.assertEqual(len(read_tree(out)), len(self.URLS))
+                    shutil.rmtree(out)
+
+    def test_errors(self, _):
+        with TemporaryDirectory() as tmp:
+            fname = self.get_archive(tmp)
+            with open(fname, 'rb') as fp:
+                data = fp.read()
+            with open(fname, 'wb') as fp:
+                fp.write(data.replace(b'"0 a"', b'"\\x"'))
+            out = os.path.join(tmp, 'out')
+            with open(fname, 'rb') as fp:
+                self.assertRaises(ValueError, extract_split, fp, out, 2, True)
+            gz = fname + '.gz'
+            with gzip.open(gz, 'wb') as fp:
+                fp.write(data)
+            with open(gz, 'rb') as fp:
+                self.assertRaises(ValueError, extract_split, fp, out, 2)
+
+
+class TestExtractAsync(TestCase):
+    DATA = json.dumps(TEST_ARCHIVE).encode('utf-8')
+
+    @staticmethod
+    async def chunks(data, size=7, error=None):
+        for i in range(0, len(data), size):
+            await asyncio.sleep(0)
+            yield data[i:i + size]
+        if error is not None:
+            raise error
+
+    @staticmethod
+    async def collect(stream, sink, **kwargs):
+        return [result async for result
+                in extract_async(stream, sink, **kwargs)]
+
+    def test_extract_async(self):
+        sink = MemorySink()
+        results = asyncio.run(self.collect(self.chunks(self.DATA), sink,
+                                           subdirs=True, queue_size=1))
+        self.assertEqual([result.status for result in results],
+                         ['written', 'written', 'empty'])
+        self.assertEqual(sink.files, {
+            os.path.join('127.0.0.1', 'index.html'): b'test',
+            os.path.join('127.0.0.1', 'dir'): b'test2\n'
+        })
+
+    def test_stream_reader(self):
+        async def run(tmp):
+            stream = asyncio.StreamReader()
+            stream.feed_data(gzip.compress(self.DATA))
+            stream.feed_eof()
+            return await self.collect(stream, FileSink(tmp), jobs=2)
+
+        with TemporaryDirectory() as tmp:
+            results = asyncio.run(run(tmp))
+            self.assertEqual(len(results), 3)
+            with open(os.path.join(tmp, 'dir'), 'rb') as fp:
+                self.assertEqual(fp.read(), b'test2\n')
+
+    def test_errors(self):
+        with self.assertRaises(IOError):
+            asyncio.run(self.collect(
+                self.chunks(self.DATA[:20], error=IOError()), MemorySink()
+            ))
+        with self.assertRaises(Exception):
+            asyncio.run(self.collect(self.chunks(self.DATA[:100]),
+                                     MemorySink()))
+
+    def test_close(self):
+        async def run():
+            results = extract_async(self.chunks(self.DATA * 2), MemorySink())
+            async for result in results:
+                break
+            await results.aclose()
+            return result
+
+        self.assertEqual(asyncio.run(run()).index, 0)
+
+
+@patch('har_extractor.BASE64_CHUNK_SIZE', new=4)
+@patch('sys.stdout', new_callable=StringIO)
+class TestExtractArchive(TestCase):
+    ENTRIES = TEST_ARCHIVE['log']['entries'] + [
+        {
+            'request': {'url': 'https://127.0.0.1/dir/'},
+            'response': {'content': {'text': 'test'}}
+        }
+    ]
+    CONTENTS = {
+        '127.0.0.1/index.html': b'test',
+        '127.0.0.1/dir': b'test2\n',
+        '127.0.0.1/dir.1': b'test'
+    }
+
+    def test_zip(self, stdout):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.zip')
+            extract(self.ENTRIES, path, subdirs=True, verbose=True)
+            self.assertIn('\t----> %s/127.0.0.1/dir.1\n' % path,
+                          stdout.getvalue())
+            with zipfile.ZipFile(path) as fp:
+                self.assertEqual(
+                    {name: fp.read(name) for name in fp.namelist()},
+                    self.CONTENTS
+                )
+
+    def test_tar(self, stdout):
+        with TemporaryDirectory() as tmp:
+            for ext in ('.tar', '.tar.gz', '.tar.bz2', '.tar.xz'):
+                path = os.path.join(tmp, 'out' + ext)
+                extract(self.ENTRIES, path, subdirs=True)
+                with tarfile.open(path) as fp:
+                    self.assertEqual(
+                        {info.name: fp.extractfile(info).read()
+                         for info in fp.getmembers()},
+                        self.CONTENTS
+                    )
+
+    def test_tar_dedupe(self, stdout):
+        entries = self.ENTRIES + [
+            {
+                'request': {'url': 'https://127.0.0.1/copy'},
+                'response': {
+                    'content': {'text': 'dGVzdDIK', 'encoding': 'base64'}
+                }
+            }
+        ]
+        with TemporaryDirectory() as tmp, \
+             patch('har_extractor.BASE64_CHUNK_SIZE', new=1024):
+            path = os.path.join(tmp, 'out.tar')
+            extract(entries, path, subdirs=True, verbose=True, dedupe=True)
+            self.assertTrue(stdout.getvalue().endswith(
+                '2 duplicates, 10B saved\n'
+            ))
+            with tarfile.open(path) as fp:
+                links = {
+                    info.name: info.linkname
+                    for info in fp.getmembers() if info.islnk()
+                }
+                self.assertEqual(fp.extractfile('127.0.0.1/copy').read(),
+                                 b'test2\n')
+            self.assertEqual(links, {
+                '127.0.0.1/dir.1': '127.0.0.1/index.html',
+                '127.0.0.1/copy': '127.0.0.1/dir'
+            })
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_tar_invalid(self, stderr, stdout):
+        entries = [
+            {
+                'request': {'url': 'https://127.0.0.1/a'},
+                'response': {
+                    'content': {'text': 'dGVzdD!IK', 'encoding': 'base64'}
+                }
+            },
+            {
+                'request': {'url': 'https://127.0.0.1/b'},
+                'response': {
+                    'content': {'text': 'dGVzdA=', 'encoding': 'base64'}
+                }
+            }
+        ] + self.ENTRIES
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.tar')
+            extract(entries, path, subdirs=True, exit_on_error=False)
+            self.assertEqual(len(stderr.getvalue().splitlines()), 1)
+            with tarfile.open(path) as fp:
+                self.assertEqual(fp.extractfile('127.0.0.1/a').read(),
+                                 b'test2\n')
+                self.assertEqual(fp.extractfile('127.0.0.1/dir').read(),
+                                 b'test2\n')
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_zip_invalid(self, stderr, stdout):
+        entries = [
+            {
+                'request': {'url': 'https://127.0.0.1/a'},
+                'response': {
+                    'content': {'text': 'dGVzdA=', 'encoding': 'base64'}
+                }
+            }
+        ] + self.ENTRIES
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.zip')
+            extract(entries, path, subdirs=True, exit_on_error=False)
+            self.assertEqual(len(stderr.getvalue().splitlines()), 1)
+            with zipfile.ZipFile(path) as fp:
+                self.assertEqual(sorted(fp.namelist()), sorted(self.CONTENTS))
+
+    def test_dirs(self, stdout):
+        entries = [
+            make_entry('https://127.0.0.1/a', 'a'),
+            make_entry('https://127.0.0.1/a.1', 'a.1'),
+            make_entry('https://127.0.0.1/a/b', 'b')
+        ]
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.tar')
+            extract(entries, path, subdirs=True)
+            with tarfile.open(path) as fp:
+                self.assertEqual(
+                    {info.name: fp.extractfile(info).read()
+                     for info in fp.getmembers()},
+                    {'127.0.0.1/a/index.html': b'a',
+                     '127.0.0.1/a/index.1.html': b'a.1',
+                     '127.0.0.1/a/b': b'b'}
+                )
+            with self.assertRaises(ValueError):
+                extract(iter(entries), os.path.join(tmp, 'out.zip'),
+                        subdirs=True)
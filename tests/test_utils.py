@@ -1,19 +1,37 @@
 # pylint:disable=too-many-arguments
 
 from unittest import TestCase
-from unittest.mock import patch, mock_open, call
+from unittest.mock import patch, mock_open, call, ANY
 
-from io import BytesIO
+from io import BytesIO, StringIO
+from base64 import b64encode
+from tempfile import TemporaryDirectory
 
+import os
 import json
+import gzip
+import bz2
+import lzma
+
+import har_extractor
 
 from har_extractor import (
-    format_size, get_unused_name, write, get_out_dir,
+    format_size, get_unused_name, write, get_out_dir, get_resume_dir,
     format_entry, get_entry_content, get_entry_path,
-    get_entries, dirnames, move_files_to_dir, make_entry_dirs
+    get_entries, dirnames, move_files_to_dir, make_entry_dirs,
+    NameAllocator, b64decode_chunks, decode_content, FileText,
+    scan_entries, index_row, index_entry, make_index, read_index,
+    get_index_path, get_indexed_entries, EntryFilter,
+    parse_size, parse_status, select_entries, get_metadata, list_entries,
+    get_compression, decompress, get_archive_format,
+    Stats, plan_layout, follow_entries, read_lines, map_file, parse_shard,
+    get_shard_path, get_input_size, get_iterative
 )
 
-from data import TEST_ARCHIVE
+from data import (
+    TEST_ARCHIVE, TEST_ARCHIVE_INVALID,
+    TEST_ARCHIVE_LIST, TEST_ARCHIVE_INVALID_LIST, make_entry
+)
 
 
 class TestUtils(TestCase):
@@ -38,6 +56,49 @@ class TestUtils(TestCase):
         write(b'\x01\x02\x03', '')
         open_mock.assert_called_with('', 'wb')
         handle.write.assert_called_with(b'\x01\x02\x03')
+        write(iter([b'\x01', b'\x02']), 'chunks')
+        open_mock.assert_called_with('chunks', 'wb')
+        handle.write.assert_has_calls([call(b'\x01'), call(b'\x02')])
+
+    @patch('os.remove')
+    @patch('builtins.open', new_callable=mock_open)
+    def test_write_chunks_error(self, open_mock, remove):
+        def chunks():
+            yield b'\x01'
+            raise ValueError
+        with self.assertRaises(ValueError):
+            write(chunks(), 'fname')
+        open_mock.assert_called_with('fname', 'wb')
+        remove.assert_called_with('fname')
+
+    def test_b64decode_chunks(self):
+        data = bytes(range(256)) * 3
+        text = b64encode(data).decode('ascii')
+        for size in (1, 4, 5, 64, 1024, 4096):
+            self.assertEqual(b''.join(b64decode_chunks(text, size)), data)
+        text = '\n'.join(text[i:i + 76] for i in range(0, len(text), 76))
+        self.assertEqual(b''.join(b64decode_chunks(text, 64)), data)
+        self.assertEqual(list(b64decode_chunks('')), [])
+        with self.assertRaises(ValueError):
+            list(b64decode_chunks('dGVzdA=', 4))
+
+    def test_get_archive_format(self):
+        self.assertIsNone(get_archive_format('dir'))
+        self.assertIsNone(get_archive_format('file.har.d'))
+        self.assertEqual(get_archive_format('out.zip'), 'zip')
+        self.assertEqual(get_archive_format('out.TAR'), 'w')
+        self.assertEqual(get_archive_format('out.tar.gz'), 'w:gz')
+        self.assertEqual(get_archive_format('out.tgz'), 'w:gz')
+        self.assertEqual(get_archive_format('out.tar.xz'), 'w:xz')
+
+    def test_decode_content(self):
+        self.assertEqual(decode_content('text', None), 'text')
+        self.assertEqual(decode_content('text', None, 1), 'text')
+        self.assertEqual(decode_content('dGVzdA==', 'base64'), b'test')
+        self.assertEqual(decode_content('dGVzdA==', 'base64', 8), b'test')
+        chunks = decode_content('dGVzdA==', 'base64', 4)
+        self.assertNotIsInstance(chunks, bytes)
+        self.assertEqual(list(chunks), [b'tes', b't'])
 
     @patch('os.path.exists')
     def test_get_unused_name(self, exists):
@@ -48,6 +109,54 @@ class TestUtils(TestCase):
         exists.side_effect = [True, True, True, False]
         self.assertEqual(get_unused_name('/dir/name.ext'), '/dir/name.3.ext')
 
+    @patch('os.walk', return_value=[
+        ('/dir', ['sub'], ['name.ext', 'name.1.ext']),
+        ('/dir/sub', [], ['file'])
+    ])
+    def test_name_allocator(self, walk):
+        names = NameAllocator('/dir')
+        walk.assert_called_with('/dir')
+        self.assertTrue(names.exists('/dir/sub'))
+        self.assertTrue(names.exists('/dir/sub/file'))
+        self.assertFalse(names.exists('/dir/other'))
+
+        self.assertEqual(names.claim('/dir/other'), '/dir/other')
+        self.assertEqual(names.claim('/dir/other'), '/dir/other.1')
+        self.assertEqual(names.claim('/dir/name.ext'), '/dir/name.2.ext')
+        self.assertEqual(names.claim('/dir/name.ext'), '/dir/name.3.ext')
+        self.assertEqual(names.claim('/dir/sub'), '/dir/sub.1')
+        self.assertEqual(names.claim('/dir/x/y'), '/dir/x/y')
+        self.assertTrue(names.exists('/dir/x'))
+        self.assertEqual(walk.call_count, 1)
+
+        names.release('/dir/name.2.ext')
+        self.assertEqual(names.claim('/dir/name.ext'), '/dir/name.2.ext')
+        self.assertEqual(names.claim('/dir/name.ext'), '/dir/name.4.ext')
+
+        names.rename('/dir/other.1', '/dir/other/index.html')
+        self.assertFalse(names.exists('/dir/other.1'))
+        self.assertTrue(names.exists('/dir/other/index.html'))
+        self.assertEqual(names.claim('/dir/other'), '/dir/other.1')
+
+        self.assertTrue(names.is_dir('/dir/sub'))
+        self.assertFalse(names.is_dir('/dir/x'))
+        names.add_dir('/dir/x/y/z')
+        self.assertTrue(names.is_dir('/dir/x/y'))
+        self.assertTrue(names.is_dir('/dir/x/y/z'))
+        names.rename('/dir/x', '/dir/other/index.1.html')
+        self.assertFalse(names.is_dir('/dir/x'))
+        self.assertFalse(names.is_dir('/dir/x/y/z'))
+        self.assertTrue(names.is_dir('/dir/other/index.1.html/y/z'))
+        self.assertFalse(names.exists('/dir/x/y'))
+        self.assertTrue(names.exists('/dir/other/index.1.html/y'))
+        self.assertTrue(names.is_dir('/dir/sub'))
+
+        names.add_dir('/dir/a.1')
+        self.assertEqual(names.claim('/dir/a'), '/dir/a')
+        self.assertEqual(names.claim('/dir/a'), '/dir/a.2')
+        names.rename('/dir/a.1', '/dir/a.2/index.1.html')
+        self.assertEqual(names.claim('/dir/a'), '/dir/a.1')
+
     @patch('os.path.exists', return_value=False)
     @patch('os.path.isdir', return_value=True)
     def test_get_out_dir(self, isdir, exists):
@@ -70,6 +179,22 @@ class TestUtils(TestCase):
             isdir.return_value = False
             get_out_dir('path', 'default')
 
+        self.assertEqual(get_out_dir('out.zip', 'default'), 'out.zip')
+        isdir.return_value = True
+        self.assertEqual(get_out_dir('out.zip', 'default'),
+                         'out.zip/default')
+
+    @patch('os.path.exists', return_value=True)
+    def test_get_resume_dir(self, exists):
+        self.assertEqual(get_resume_dir(None, 'default'), 'default')
+        self.assertEqual(get_resume_dir('path', 'path'), 'path')
+        self.assertEqual(get_resume_dir('path', 'path/default'), 'path')
+        exists.return_value = False
+        self.assertEqual(get_resume_dir('path', 'path/default'),
+                         'path/default')
+        self.assertEqual(get_resume_dir('out.zip', 'out.zip'), 'out.zip')
+        exists.assert_called_with(os.path.join('out.zip', '.journal'))
+
     @patch('har_extractor.format_size', return_value='<size>')
     def test_format_entry(self, format_size_mock):
         entry = {
@@ -95,6 +220,18 @@ class TestUtils(TestCase):
                     ' <no status text> <no mime type> <invalid size>'
         self.assertEqual(format_entry({}), formatted)
 
+    def test_list_entries(self):
+        for batch_size in (1, 2, 1024):
+            fp = StringIO()
+            list_entries(TEST_ARCHIVE['log']['entries'], fp, batch_size)
+            self.assertEqual(fp.getvalue(), TEST_ARCHIVE_LIST)
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            list_entries(TEST_ARCHIVE_INVALID['log']['entries'])
+        self.assertEqual(stdout.getvalue(), TEST_ARCHIVE_INVALID_LIST)
+        fp = StringIO()
+        list_entries([], fp)
+        self.assertEqual(fp.getvalue(), '')
+
     def test_get_entry_path(self):
         test = lambda url: get_entry_path({'request': {'url': url}})
         self.assertEqual(test('http://127.0.0.1'), 'index.html')
@@ -177,6 +314,67 @@ class TestUtils(TestCase):
         self.assertEqual(move.call_count, 0)
         self.assertEqual(move_files_to_dir_.call_count, 0)
 
+    @patch('os.makedirs')
+    def test_make_entry_dirs_cached(self, mkdirs):
+        names = NameAllocator()
+        make_entry_dirs('/root', '/root/dir/entry', names)
+        make_entry_dirs('/root', '/root/dir/entry.1', names)
+        make_entry_dirs('/root', '/root/dir/sub/entry', names)
+        mkdirs.assert_has_calls([
+            call('/root/dir', exist_ok=True),
+            call('/root/dir/sub', exist_ok=True)
+        ])
+        self.assertEqual(mkdirs.call_count, 2)
+
+    def test_make_entry_dirs_moved(self):
+        with TemporaryDirectory() as tmp:
+            names = NameAllocator(tmp)
+            path = names.claim(os.path.join(tmp, 'a.1', 'x'))
+            make_entry_dirs(tmp, path, names)
+            write('x', path)
+            path = names.claim(os.path.join(tmp, 'a'))
+            write('a', path)
+            path = names.claim(os.path.join(tmp, 'a', 'b'))
+            make_entry_dirs(tmp, path, names)
+            write('b', path)
+            self.assertEqual(sorted(os.listdir(tmp)), ['a'])
+            self.assertTrue(os.path.isfile(
+                os.path.join(tmp, 'a', 'index.1.html', 'x')
+            ))
+
+            path = names.claim(os.path.join(tmp, 'a.1', 'y'))
+            make_entry_dirs(tmp, path, names)
+            write('y', path)
+            self.assertTrue(os.path.isfile(path))
+
+    def test_plan_layout(self):
+        def entry(url, text='x'):
+            return {
+                'request': {'url': url},
+                'response': {'content': {'text': text}}
+            }
+        entries = [
+            entry('http://h/a'),
+            entry('http://h/a/b'),
+            entry('http://h/a'),
+            entry('http://h/a.1/x'),
+            entry('http://h/c', ''),
+            {'response': {'content': {'text': 'x'}}},
+            entry('http://h/a/b')
+        ]
+        self.assertEqual(plan_layout(entries, '/out', True), [
+            '/out/h/a/index.html',
+            '/out/h/a/b',
+            '/out/h/a/index.1.html',
+            '/out/h/a.1/x',
+            None,
+            None,
+            '/out/h/a/b.1'
+        ])
+        self.assertEqual(plan_layout(entries, '/out'), [
+            '/out/a', '/out/b', '/out/a.1', '/out/x', None, None, '/out/b.1'
+        ])
+
     @patch('har_extractor.get_unused_name', return_value='unused')
     @patch('har_extractor.move_files_to_dir')
     @patch('shutil.move')
@@ -217,10 +415,55 @@ class TestUtils(TestCase):
         move.assert_called_with('/root/dir/dir2/dir3', 'unused')
         self.assertEqual(move.call_count, 1)
 
-        move_files_to_dir_.assert_called_with('/root/dir/dir2/dir3', 'unused')
+        move_files_to_dir_.assert_called_with('/root/dir/dir2/dir3', 'unused',
+                                              None)
         self.assertEqual(move_files_to_dir_.call_count, 1)
 
 
+class TestStats(TestCase):
+    @patch('har_extractor.perf_counter', side_effect=range(100))
+    def test_stats(self, _):
+        stats = Stats()
+        self.assertEqual(list(stats.iterate([1, 2])), [1, 2])
+        stats.add('write', 0.5, 10, 20)
+        stats.add('write', 0.5, 10, 20)
+        stats.add_time('decode', 2)
+        stats.set_input_size(100)
+        stats.stop()
+        data = stats.to_dict()
+        self.assertEqual(data['entries'], 2)
+        self.assertEqual(data['phases']['parse'],
+                         {'time': 3, 'calls': 2, 'bytes_in': 100,
+                          'bytes_out': 0, 'calls_per_s': 2 / 3})
+        self.assertEqual(data['phases']['write'],
+                         {'time': 1, 'calls': 2, 'bytes_in': 20,
+                          'bytes_out': 40, 'calls_per_s': 2})
+        self.assertEqual(data['phases']['decode']['calls'], 0)
+        self.assertEqual(data['phases']['mkdir']['calls_per_s'], 0)
+        lines = stats.format().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[-1].startswith('2 entries in '))
+
+
+class TestShard(TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2'), (2, 2))
+        self.assertEqual(parse_shard(' 1 : 3 '), (1, 3))
+        for value in ('', '0', '1:0', 'x', '2:', '33'):
+            self.assertRaises(ValueError, parse_shard, value)
+
+    def test_get_shard_path(self):
+        entry = {'request': {'url': 'http://host/dir/file.png?x=1'}}
+        path = get_shard_path(entry, 2, 3)
+        self.assertEqual(path.split(os.sep)[2], 'file.png')
+        self.assertEqual(path, get_shard_path(entry, 2, 3))
+        self.assertEqual([len(part) for part in path.split(os.sep)[:2]],
+                         [3, 3])
+        other = {'request': {'url': 'http://host/other/file.png'}}
+        self.assertNotEqual(get_shard_path(other, 2, 3), path)
+        self.assertRaises(ValueError, get_shard_path, {}, 1)
+
+
 class TestGetEntries(TestCase):
     def test_iterative(self):
         fp = BytesIO(json.dumps(TEST_ARCHIVE).encode('utf-8'))
@@ -228,6 +471,44 @@ class TestGetEntries(TestCase):
         self.assertNotIsInstance(items, list)
         self.assertEqual(list(items), TEST_ARCHIVE['log']['entries'])
 
+    @patch('har_extractor.BASE64_CHUNK_SIZE', new=16)
+    def test_iterative_file(self):
+        data = bytes(range(256))
+        text = 'caf\u00e9 "\\" \U0001f600\n' * 4
+        entries = [
+            {
+                'request': {'url': '/a', 'postData': {'text': text}},
+                'response': {'content': {
+                    'text': b64encode(data).decode('ascii'),
+                    'encoding': 'base64'
+                }}
+            },
+            make_entry('/b', text),
+            make_entry('/c', 'c')
+        ]
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            for ensure_ascii in (True, False):
+                with open(fname, 'w', encoding='utf-8') as fp:
+                    fp.write('  ')
+                    json.dump({'log': {'entries': entries}}, fp,
+                              ensure_ascii=ensure_ascii)
+                with open(fname, 'rb') as fp:
+                    fp.read(2)
+                    items = list(get_entries(fp, True))
+                self.assertEqual([item['request'] for item in items],
+                                 [entry['request'] for entry in entries])
+                texts = [item['response']['content']['text']
+                         for item in items]
+                self.assertIsInstance(texts[0], FileText)
+                self.assertIsInstance(texts[1], FileText)
+                self.assertEqual(texts[2], 'c')
+                self.assertEqual(
+                    b''.join(decode_content(texts[0], 'base64')), data
+                )
+                self.assertEqual(b''.join(decode_content(texts[1], None, 5)),
+                                 text.encode('utf-8'))
+
     def test_not_iterative(self):
         fp = BytesIO(json.dumps(TEST_ARCHIVE).encode('utf-8'))
         items = get_entries(fp, False)
@@ -241,9 +522,330 @@ class TestGetEntries(TestCase):
         self.assertNotIsInstance(items, list)
         self.assertEqual(list(items), TEST_ARCHIVE['log']['entries'])
 
+    def test_compressed(self):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        entries = TEST_ARCHIVE['log']['entries']
+        for compress in (gzip.compress, bz2.compress, lzma.compress):
+            for iterative in (True, False):
+                fp = BytesIO(compress(data))
+                self.assertEqual(list(get_entries(fp, iterative)), entries)
+            fp = BytesIO(compress(data))
+            self.assertEqual(len(list(get_metadata(fp))), len(entries))
+            fp = BytesIO(compress(data))
+            self.assertEqual(
+                list(select_entries(fp, EntryFilter(status='404'))),
+                list(enumerate(entries))[2:]
+            )
+
+    @patch('sys.stdin')
+    def test_stdin_compressed(self, stdin):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        stdin.buffer = BytesIO(gzip.compress(data))
+        items = get_entries(stdin, False)
+        self.assertEqual(list(items), TEST_ARCHIVE['log']['entries'])
+
+    def test_get_compression(self):
+        self.assertIsNone(get_compression(BytesIO(b'{}')))
+        self.assertIsNone(get_compression(BytesIO(b'')))
+        fp = BytesIO(gzip.compress(b'{}'))
+        self.assertEqual(get_compression(fp), 'gzip')
+        self.assertEqual(fp.tell(), 0)
+        self.assertEqual(decompress(fp).read(), b'{}')
+        self.assertEqual(get_compression(BytesIO(bz2.compress(b'{}'))),
+                         'bzip2')
+        self.assertEqual(get_compression(BytesIO(lzma.compress(b'{}'))),
+                         'xz')
+        fp = BytesIO(b'{}')
+        self.assertIs(decompress(fp), fp)
+
+    def test_file(self):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        entries = TEST_ARCHIVE['log']['entries']
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'wb') as fp:
+                fp.write(b'  ' + data)
+            for backend in (har_extractor.json_backend, None):
+                with patch('har_extractor.json_backend', new=backend):
+                    with open(fname, 'rb') as fp:
+                        fp.read(2)
+                        self.assertEqual(get_entries(fp, False), entries)
+            with open(fname, 'wb') as fp:
+                fp.write(b'{"log": {"entries": [{"url": "a\\ud800b"}]}}')
+            for backend in (har_extractor.json_backend, None):
+                with patch('har_extractor.json_backend', new=backend):
+                    with open(fname, 'rb') as fp:
+                        self.assertEqual(get_entries(fp, False),
+                                         [{'url': 'a\ud800b'}])
+            with open(fname, 'wb') as fp:
+                pass
+            with open(fname, 'rb') as fp:
+                self.assertRaises(ValueError, get_entries, fp, False)
+
+    def test_get_iterative(self):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        size = len(data)
+        self.assertFalse(get_iterative(BytesIO(data)))
+        self.assertTrue(get_iterative(BytesIO(data), True))
+        self.assertTrue(get_iterative(BytesIO(data), 'auto', 1 << 30))
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test')
+            for compress, expected in ((bytes, size),
+                                       (gzip.compress, size),
+                                       (bz2.compress, None)):
+                with open(fname, 'wb') as fp:
+                    fp.write(compress(data))
+                with open(fname, 'rb') as fp:
+                    if expected is not None:
+                        self.assertEqual(get_input_size(fp), expected)
+                        self.assertEqual(fp.tell(), 0)
+                    else:
+                        self.assertGreater(get_input_size(fp), size)
+                    self.assertFalse(get_iterative(fp, None, 1 << 30))
+                    self.assertTrue(get_iterative(fp, None, size))
+                    self.assertFalse(get_iterative(fp, False, size))
+                    self.assertEqual(get_entries(fp, False),
+                                     TEST_ARCHIVE['log']['entries'])
+            with patch('har_extractor.ijson', new=None):
+                with open(fname, 'rb') as fp:
+                    self.assertFalse(get_iterative(fp, 'auto', 1))
+
+    def test_map_file(self):
+        self.assertIsNone(map_file(BytesIO(b'{}')))
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test')
+            with open(fname, 'wb') as fp:
+                fp.write(b'{}')
+            with open(fname, 'rb') as fp:
+                fp.read(1)
+                data, offset = map_file(fp)
+                self.assertEqual(data[offset:], b'}')
+                data.close()
+
     @patch('har_extractor.ijson', new=None)
     def test_no_ijson(self):
         fp = BytesIO(json.dumps(TEST_ARCHIVE).encode('utf-8'))
         items = get_entries(fp, True)
         self.assertIsInstance(items, list)
         self.assertEqual(items, TEST_ARCHIVE['log']['entries'])
+
+
+class TestFollow(TestCase):
+    ENTRIES = TEST_ARCHIVE['log']['entries']
+
+    def test_read_lines(self):
+        data = b'a\nbcd\n\nef'
+        for block_size in (1, 2, 100):
+            self.assertEqual(
+                list(read_lines(BytesIO(data), block_size)),
+                [b'a', b'bcd', b'', b'ef']
+            )
+
+    @patch('time.sleep', side_effect=KeyboardInterrupt)
+    def test_follow_ndjson(self, sleep):
+        data = ''.join(json.dumps(entry) + '\n' for entry in self.ENTRIES)
+        fp = BytesIO(data.encode('utf-8'))
+        self.assertEqual(list(follow_entries(fp)), self.ENTRIES)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_follow_pipe(self):
+        read, write_ = os.pipe()
+        with open(read, 'rb') as fp:
+            with open(write_, 'wb') as out:
+                entries = follow_entries(fp, exit_on_error=False)
+                for entry in self.ENTRIES:
+                    out.write(json.dumps(entry).encode('utf-8') + b'\n')
+                    out.flush()
+                    self.assertEqual(next(entries), entry)
+                out.write(b'\n[1]\n{"request": {}}')
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                self.assertEqual(list(entries), [{'request': {}}])
+        self.assertTrue(stderr.getvalue().startswith('Invalid entry: '))
+
+    def test_follow_har(self):
+        data = json.dumps(TEST_ARCHIVE).encode('utf-8')
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'wb') as fp:
+                fp.write(data[:len(data) // 2])
+
+            def sleep(_):
+                with open(fname, 'ab') as fp:
+                    fp.write(data[len(data) // 2:])
+
+            with open(fname, 'rb') as fp, \
+                 patch('time.sleep', side_effect=sleep) as sleep_:
+                self.assertEqual(list(follow_entries(fp, 'har')),
+                                 self.ENTRIES)
+            self.assertEqual(sleep_.call_count, 1)
+
+
+class TestIndex(TestCase):
+    ARCHIVE = {
+        'pages': [{'title': '"log": {"entries": []}'}],
+        'log': {
+            'creator': {'name': '[{'},
+            'entries': TEST_ARCHIVE['log']['entries'] + [
+                {
+                    'request': {'url': 'http://127.0.0.1/"{[]}\\:,'},
+                    'response': {
+                        'status': 200,
+                        'content': {'text': '\\"}]"{', 'size': 5}
+                    }
+                }
+            ] + TEST_ARCHIVE_INVALID['log']['entries'],
+            'comment': [1]
+        }
+    }
+
+    def test_scan_entries(self):
+        entries = self.ARCHIVE['log']['entries']
+        for indent in (None, 2):
+            data = json.dumps(self.ARCHIVE, indent=indent).encode('utf-8')
+            for block_size in (1, 7, 1024):
+                items = list(scan_entries(BytesIO(data),
+                                          block_size=block_size))
+                self.assertEqual(
+                    [json.loads(data[offset:offset + length])
+                     for offset, length, _ in items],
+                    entries
+                )
+                for (_, _, skeleton), entry in zip(items, entries):
+                    skeleton = json.loads(skeleton)
+                    content = skeleton.get('response', {}).get('content', {})
+                    if 'text' in content:
+                        text = entry['response']['content']['text']
+                        self.assertEqual(content['text'],
+                                         '-' if text else '')
+                        content['text'] = entry['response']['content']['text']
+                    self.assertEqual(skeleton, entry)
+
+    def test_scan_entries_truncated(self):
+        entries = self.ARCHIVE['log']['entries']
+        data = json.dumps({'version': 1.25, 'log': self.ARCHIVE['log']})
+        data = data.encode('utf-8')
+        for size in range(len(data)):
+            items = list(scan_entries(BytesIO(data[:size]), block_size=7))
+            self.assertEqual(
+                [json.loads(data[offset:offset + length])
+                 for offset, length, _ in items],
+                entries[:len(items)]
+            )
+        with self.assertRaises(ValueError):
+            list(scan_entries(BytesIO(data.replace(b'"request"', b'request'))))
+
+    def test_index_entry(self):
+        entry = TEST_ARCHIVE['log']['entries'][1]
+        row = index_row(1, 2, entry)
+        self.assertEqual(row, [1, 2, 'GET', 'https://127.0.0.1/dir/',
+                               200, 'OK', 'text/plain', 8])
+        meta = index_entry(row)
+        self.assertEqual(meta['request'], entry['request'])
+        self.assertNotIn('text', meta['response']['content'])
+        self.assertEqual(index_entry(index_row(0, 0, {})),
+                         {'request': {}, 'response': {'content': {}}})
+
+    def test_make_index(self):
+        with TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'test.har')
+            with open(fname, 'w') as fp:
+                json.dump(self.ARCHIVE, fp)
+            self.assertIsNone(read_index(fname))
+            entries = self.ARCHIVE['log']['entries']
+            self.assertEqual(make_index(fname), len(entries))
+            self.assertTrue(os.path.exists(get_index_path(fname)))
+            rows = list(read_index(fname))
+            self.assertEqual([row[3] for row in rows],
+                             [entry.get('request', {}).get('url')
+                              for entry in entries])
+            with open(fname, 'rb') as fp:
+                self.assertEqual(list(get_indexed_entries(fp, rows)),
+                                 list(enumerate(entries)))
+                self.assertEqual(
+                    list(get_indexed_entries(fp, rows,
+                                             EntryFilter(status='200'))),
+                    [(index, entry) for index, entry in enumerate(entries)
+                     if entry.get('response', {}).get('status') == 200]
+                )
+            with open(fname, 'a') as fp:
+                fp.write('\n')
+            self.assertIsNone(read_index(fname))
+
+    def test_entry_filter(self):
+        entries = TEST_ARCHIVE['log']['entries']
+        test = lambda **kwargs: list(filter(EntryFilter(**kwargs).match,
+                                            entries))
+        self.assertEqual(test(), entries)
+        self.assertEqual(test(url='/dir'), entries[1:2])
+        self.assertEqual(test(host=['127.0.0.1']), entries)
+        self.assertEqual(test(host=['localhost']), [])
+        self.assertEqual(test(mime=['text/*']), entries)
+        self.assertEqual(test(mime=['image/*', 'TEXT/PLAIN']), entries)
+        self.assertEqual(test(mime=['image/*']), [])
+        self.assertEqual(test(status='2xx'), entries[:2])
+        self.assertEqual(test(status=[(404, 404)]), entries[2:])
+        self.assertEqual(test(min_size=4), entries[:2])
+        self.assertEqual(test(min_size=5), entries[1:2])
+        self.assertEqual(test(max_size=4), [entries[0], entries[2]])
+        self.assertEqual(test(status='200', min_size=5), entries[1:2])
+        self.assertFalse(EntryFilter(url='.').match({}))
+        self.assertFalse(EntryFilter(status='200').match({}))
+        self.assertFalse(EntryFilter(max_size=10).match({}))
+        self.assertFalse(EntryFilter(mime=['*']).match({}))
+        self.assertTrue(EntryFilter(mime=['text/html']).match({
+            'response': {'content': {'mimeType': 'text/html; charset=utf-8'}}
+        }))
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('0'), 0)
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('1k'), 1024)
+        self.assertEqual(parse_size('1.5K'), 1536)
+        self.assertEqual(parse_size('2M'), 2 * 1024 ** 2)
+        with self.assertRaises(ValueError):
+            parse_size('1X')
+        with self.assertRaises(ValueError):
+            parse_size('')
+
+    def test_parse_status(self):
+        self.assertEqual(parse_status('200'), [(200, 200)])
+        self.assertEqual(parse_status('200-299, 4XX'),
+                         [(200, 299), (400, 499)])
+        with self.assertRaises(ValueError):
+            parse_status('2x')
+        with self.assertRaises(ValueError):
+            parse_status('a-b')
+
+    def test_get_metadata(self):
+        data = json.dumps(self.ARCHIVE).encode('utf-8')
+        items = list(get_metadata(BytesIO(data)))
+        self.assertEqual(len(items), len(self.ARCHIVE['log']['entries']))
+        self.assertEqual(items[3]['response']['content'],
+                         {'text': '-', 'size': 5})
+        with patch('sys.stdin') as stdin:
+            stdin.buffer = BytesIO(data)
+            self.assertEqual(list(get_metadata(stdin)), items)
+
+    @patch('har_extractor.get_entries')
+    def test_select_entries(self, get_entries_):
+        data = json.dumps(self.ARCHIVE).encode('utf-8')
+        entries = self.ARCHIVE['log']['entries']
+        expected = [
+            (index, entry) for index, entry in enumerate(entries)
+            if entry.get('response', {}).get('status') == 200
+        ]
+        selected = select_entries(BytesIO(data), EntryFilter(status='200'))
+        self.assertEqual(list(selected), expected)
+        self.assertEqual(get_entries_.call_count, 0)
+
+        get_entries_.return_value = entries
+        selected = select_entries(BytesIO(data), EntryFilter(status='200'),
+                                  False)
+        self.assertEqual(list(selected), expected)
+        get_entries_.assert_called_with(ANY, False)
+
+        with patch('sys.stdin') as stdin:
+            selected = select_entries(stdin, EntryFilter(status='200'),
+                                      False)
+            self.assertEqual(len(list(selected)), 4)
+            get_entries_.assert_called_with(stdin, False)